@@ -1,9 +1,71 @@
-
-
+import json
+import hashlib
 import streamlit as st
 import requests
 import folium
+from requests.adapters import HTTPAdapter
 from streamlit_folium import st_folium
+from geo import decode_polyline
+
+API_URL = "http://localhost:8000"
+
+@st.cache_resource
+def get_session():
+    """One keep-alive HTTP session shared by every Streamlit session in this process."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+    return session
+
+class TourNotPlanned(Exception):
+    """A plan_tour response without stops; raised so st.cache_data does not keep it."""
+
+    def __init__(self, data):
+        super().__init__(data.get("itinerary"))
+        self.data = data
+
+@st.cache_data(ttl=600, max_entries=500, show_spinner="Planning your tour...")
+def plan_tour(preferences_key, _preferences):
+    """Posts preferences to the backend; responses with stops are cached by the preferences' hash."""
+    response = get_session().post(
+        f"{API_URL}/plan_tour/", params={"map_format": "compact"}, json=_preferences
+    )
+    response.raise_for_status()
+    data = response.json()
+    if not data.get("stops"):
+        raise TourNotPlanned(data)
+    return data
+
+@st.cache_resource(max_entries=100)
+def build_map(map_key, _map_data, reordered=False):
+    """Builds the folium map once per distinct set of stops, keyed by the map_data hash.
+
+    When the backend reordered the route, popups show its schedule instead of the LLM's times.
+    """
+    features = _map_data["features"]
+    lon, lat = features[0]["geometry"]["coordinates"]  # Center map on the first location
+    itinerary_map = folium.Map(location=[lat, lon], zoom_start=13)
+
+    for i, feature in enumerate(features):
+        lon, lat = feature["geometry"]["coordinates"]
+        stop = feature["properties"]
+        if reordered:
+            start, end = stop.get("scheduled_start"), stop.get("scheduled_end")
+        else:
+            start, end = stop["start_time"], stop["end_time"]
+        folium.Marker(
+            location=[lat, lon],
+            popup=f"{i+1}. {stop['place']} ({start} - {end})",
+            tooltip=stop["activity"]
+        ).add_to(itinerary_map)
+
+    # The whole route as one line layer
+    route = decode_polyline(_map_data["route"], _map_data["precision"])
+    if len(route) > 1:
+        folium.PolyLine(route, color="blue", weight=2.5).add_to(itinerary_map)
+    return itinerary_map
+
+def content_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
 
 st.title("One-Day Tour Planning Assistant")
 st.write("Plan a one-day tour tailored to your preferences!")
@@ -13,62 +75,58 @@ username = st.text_input("Enter your username to log in")
 if username:
     st.write(f"Welcome, {username}!")
 
-city = st.text_input("City to Visit")
-start_time = st.text_input("Start Time (e.g., 9:00 AM)")
-end_time = st.text_input("End Time (e.g., 6:00 PM)")
-budget = st.number_input("Budget", min_value=0)
-interests = st.multiselect("Interests", ["Culture", "Adventure", "Food", "Shopping"])
-starting_point = st.text_input("Starting Point (e.g., hotel location)")
+# Grouped in a form so the script only reruns when the form is submitted
+with st.form("preferences_form"):
+    city = st.text_input("City to Visit")
+    start_time = st.text_input("Start Time (e.g., 9:00 AM)")
+    end_time = st.text_input("End Time (e.g., 6:00 PM)")
+    budget = st.number_input("Budget", min_value=0)
+    interests = st.multiselect("Interests", ["Culture", "Adventure", "Food", "Shopping"])
+    starting_point = st.text_input("Starting Point (e.g., hotel location)")
+    submitted = st.form_submit_button("Plan my Tour")
 
 # Initialize session state variables to persist data
 if "itinerary_data" not in st.session_state:
     st.session_state["itinerary_data"] = None
 if "map_data" not in st.session_state:
     st.session_state["map_data"] = None
-
-# Handle "Plan my Tour" button click
-if st.button("Plan my Tour"):
+if "weather" not in st.session_state:
+    st.session_state["weather"] = None
+if "recommendations" not in st.session_state:
+    st.session_state["recommendations"] = None
+if "route" not in st.session_state:
+    st.session_state["route"] = None
+
+# Handle "Plan my Tour" form submission
+if submitted:
+    # Save preferences and generate the itinerary in a single request
+    preferences = {
+        "user_id": username,
+        "city": city,
+        "start_time": start_time,
+        "end_time": end_time,
+        "interests": interests,
+        "budget": budget,
+        "starting_point": starting_point
+    }
     try:
-        # Collect preferences
-        response = requests.post("http://localhost:8000/collect_preferences/", json={
-            "user_id": username,
-            "city": city,
-            "start_time": start_time,
-            "end_time": end_time,
-            "budget": budget,
-            "interests": interests,
-            "starting_point": starting_point
-        })
-        response.raise_for_status()
-        st.success("Preferences collected successfully!")
+        data = plan_tour(content_hash(preferences), preferences)
+    except TourNotPlanned as e:
+        data = e.data  # shown this time, but not cached, so submitting again retries
     except requests.exceptions.RequestException as e:
-        st.error(f"Error collecting preferences: {e}")
+        st.error(f"Error planning tour: {e}")
         st.stop()
+    st.success("Preferences collected successfully!")
 
-    # Generate itinerary
-    try:
-        itinerary_response = requests.post("http://localhost:8000/generate_itinerary/", json={
-            "user_id": username,
-            "city": city,
-            "start_time": start_time,
-            "end_time": end_time, 
-            "interests": interests,
-            "budget": budget,
-            "starting_point": starting_point
-        })
-        itinerary_response.raise_for_status()
-
-        # Store data in session state
-        data = itinerary_response.json()
-        st.session_state["itinerary_data"] = data.get("itinerary")
-        st.session_state["map_data"] = data.get("map_data")
-
-        # Debugging: Display map data to check format
-        st.write("Debug - Map Data:", st.session_state["map_data"])
+    # Store data in session state
+    st.session_state["itinerary_data"] = data.get("itinerary")
+    st.session_state["map_data"] = data.get("map_data")
+    st.session_state["weather"] = data.get("weather")
+    st.session_state["recommendations"] = data.get("recommendations")
+    st.session_state["route"] = data.get("route")
 
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error generating itinerary: {e}")
-        st.stop()
+    # Debugging: Display map data to check format
+    st.write("Debug - Map Data:", st.session_state["map_data"])
 
 # Display itinerary data if available
 if st.session_state["itinerary_data"]:
@@ -76,22 +134,22 @@ if st.session_state["itinerary_data"]:
 else:
     st.error("Failed to generate itinerary. Please try again.")
 
+# Display weather for the day if available
+if st.session_state["weather"]:
+    weather = st.session_state["weather"]
+    st.write(f"**Weather:** {weather.get('forecast')} {weather.get('temperature', '')} - {weather.get('advice')}")
+
+# Suggest popular places when no interests were selected
+if st.session_state["recommendations"]:
+    st.write("Popular places to consider:", ", ".join(st.session_state["recommendations"]))
+
 # Display map if map data is available
-if st.session_state["map_data"]:
+if st.session_state["map_data"] and st.session_state["map_data"]["features"]:
     st.write("Displaying Map of Itinerary Stops:")
     try:
-        center_coords = st.session_state["map_data"][0]["coordinates"]  # Center map on the first location
-        itinerary_map = folium.Map(location=center_coords, zoom_start=13)
-
-        for i, stop in enumerate(st.session_state["map_data"]):
-            folium.Marker(
-                location=stop["coordinates"],
-                popup=f"{i+1}. {stop['place']} ({stop['start_time']} - {stop['end_time']})",
-                tooltip=stop["activity"]
-            ).add_to(itinerary_map)
-            if i > 0:
-                prev_stop = st.session_state["map_data"][i - 1]
-                folium.PolyLine([prev_stop["coordinates"], stop["coordinates"]], color="blue", weight=2.5).add_to(itinerary_map)
+        map_data = st.session_state["map_data"]
+        route = st.session_state["route"] or {}
+        itinerary_map = build_map(content_hash(map_data), map_data, bool(route.get("reordered")))
 
         # Display the map using st_folium
         st_folium(itinerary_map, width=700, height=500)
@@ -0,0 +1,77 @@
+"""Checks gazetteer lookups against the bundled sample extract.
+
+Builds an index from data/gazetteer_sample.tsv in a temporary directory and
+runs a table of place names through Gazetteer.lookup, covering exact, prefix,
+trailing-word and fuzzy matches as well as names that must miss so that
+Nominatim gets to resolve them. Exits non-zero if any lookup differs.
+
+    python bench/gazetteer_check.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gazetteer import Gazetteer, build, haversine_km  # noqa: E402
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "gazetteer_sample.tsv")
+TOLERANCE_KM = 0.01   # coordinates are stored as 32-bit floats
+
+EIFFEL = (48.85822, 2.2945)
+LOUVRE = (48.86091, 2.33614)
+ORSAY = (48.86, 2.32656)
+COLOSSEUM = (41.89021, 12.49223)
+TREVI = (41.90093, 12.48331)
+MET = (40.77937, -73.96341)
+PARIS = (48.85341, 2.3488)
+
+# (place name, city, expected coordinates or None for a miss)
+CASES = [
+    ("Eiffel Tower", "Paris", EIFFEL),
+    ("Eiffel Tower, Paris", "Paris", EIFFEL),
+    ("Tour Eiffel", "Paris", EIFFEL),
+    ("Musée d'Orsay", "Paris", ORSAY),
+    ("Paris", "Paris", PARIS),
+    ("Louvre Museum", "Paris", LOUVRE),
+    ("Colosseum", "Rome", COLOSSEUM),
+    ("Colloseum", "Rome", COLOSSEUM),
+    ("Trevi", "Rome", TREVI),
+    ("Metropolitan Museum", "New York City", MET),
+    # Shortened or prefix matches must not land on the city or another settlement
+    ("Paris Catacombs", "Paris", None),
+    ("Paris Opera", "Paris", None),
+    ("New York Public Library", "New York City", None),
+    ("Montmartre Cemetery", "Paris", None),
+    # Misspelled districts are settlements too, so fuzzy matching must not return them
+    ("Montmartr", "Paris", None),
+    ("Le Marai", "Paris", None),
+    ("Trastevre", "Rome", None),
+    # Too short to match inexactly
+    ("Col", "Rome", None),
+    ("Tre", "Rome", None),
+    # Outside the city radius
+    ("Eiffel Tower", "Rome", None),
+    ("Unknown Place", "Atlantis", None),
+]
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        index_path = os.path.join(workdir, "gazetteer.bin")
+        count = build(SAMPLE_PATH, index_path)
+        print(f"Built {count} records from {SAMPLE_PATH}")
+        gazetteer = Gazetteer(index_path)
+        for place, city, expected in CASES:
+            found = gazetteer.lookup(place, city)
+            if found is None or expected is None:
+                ok = found == expected
+            else:
+                ok = haversine_km(*found, *expected) <= TOLERANCE_KM
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {place!r} in {city}: {found} (expected {expected})")
+        gazetteer.close()
+    print(f"{len(CASES) - failures}/{len(CASES)} lookups as expected")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""Offline load test for the API, with every upstream replaced by bench/stubs.py.
+
+Starts the stubs and the API server (uvicorn main:app) pointed at them, then
+drives each scenario at each concurrency level and reports latency
+percentiles, time to first byte and throughput. Stub options such as
+--ollama-latency, --tokens-per-second or --nominatim-error-rate are passed
+through to bench/stubs.py.
+
+    python bench/load_test.py [--concurrency 1,8,32] [--requests 64] [--output load_results.json]
+    python bench/load_test.py --compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+CITIES = ["Paris", "Rome", "New York", "Jaipur", "Mumbai"]
+WEATHER_CITIES = CITIES + ["London", "Berlin", "Madrid", "Lisbon", "Vienna", "Prague", "Tokyo", "Sydney"]
+
+def preferences(i, interests=True):
+    return {
+        "user_id": f"bench-user-{i}",
+        "city": CITIES[i % len(CITIES)],
+        "start_time": "9:00 AM",
+        "end_time": "6:00 PM",
+        "budget": 100 + (i % 4) * 100,
+        "interests": ["history", "food"] if interests else [],
+        # A distinct starting point keeps each itinerary request from being coalesced
+        "starting_point": f"Hotel {i}",
+    }
+
+# name -> builds (method, path, params, json body) for the i-th request
+SCENARIOS = {
+    "generate_itinerary": lambda i: (
+        "POST", "/generate_itinerary/", {"bypass_cache": "true"}, preferences(i)),
+    "generate_itinerary_stream": lambda i: (
+        "POST", "/generate_itinerary/stream", {"bypass_cache": "true"}, preferences(i)),
+    "collect_preferences": lambda i: (
+        "POST", "/collect_preferences/", None, preferences(i, interests=i % 4 != 0)),
+    "fetch_weather": lambda i: (
+        "GET", f"/fetch_weather/{WEATHER_CITIES[i % len(WEATHER_CITIES)]}", None, None),
+}
+DEFAULT_SCENARIOS = "generate_itinerary,generate_itinerary_stream,collect_preferences,fetch_weather"
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(samples, wall_seconds):
+    latencies = [s["latency"] * 1000 for s in samples if s["ok"]]
+    ttfbs = [s["ttfb"] * 1000 for s in samples if s["ok"]]
+    statuses = Counter(str(s["status"]) for s in samples if not s["ok"])
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(latencies),
+        "error_statuses": dict(statuses),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": max(latencies, default=None),
+        },
+        "ttfb_ms": {
+            "p50": percentile(ttfbs, 50),
+            "p95": percentile(ttfbs, 95),
+            "p99": percentile(ttfbs, 99),
+        },
+    }
+
+async def timed_request(client, method, path, params, body):
+    """Sends one request and times the first body byte and the complete response."""
+    started = time.perf_counter()
+    ttfb = None
+    try:
+        async with client.stream(method, path, params=params, json=body) as response:
+            async for _ in response.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+            status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    latency = time.perf_counter() - started
+    return {
+        "ok": isinstance(status, int) and status < 400,
+        "status": status,
+        "latency": latency,
+        "ttfb": ttfb if ttfb is not None else latency,
+    }
+
+async def run_level(client, build, concurrency, total, offset):
+    """Runs `total` requests with `concurrency` requests in flight at all times."""
+    samples = []
+    next_index = iter(range(offset, offset + total))
+
+    async def worker():
+        for i in next_index:
+            samples.append(await timed_request(client, *build(i)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+async def run_benchmark(base_url, scenarios, levels, requests, warmup):
+    results = []
+    offset = 0
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as client:
+        for name in scenarios:
+            build = SCENARIOS[name]
+            await run_level(client, build, 1, warmup, offset)
+            offset += warmup
+            for concurrency in levels:
+                total = max(requests, concurrency)
+                samples, wall = await run_level(client, build, concurrency, total, offset)
+                offset += total
+                summary = {"scenario": name, "concurrency": concurrency, **summarize(samples, wall)}
+                results.append(summary)
+                print_row(summary)
+        server = {}
+        for path in ("/cache_stats", "/coalescing_stats", "/preference_write_stats", "/prompt_cache_stats",
+                     "/llm_backends", "/circuit_breakers"):
+            try:
+                server[path.strip("/")] = (await client.get(path)).json()
+            except (httpx.HTTPError, ValueError):
+                pass
+    return results, server
+
+def fmt(value):
+    return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+def print_header():
+    print(f"{'scenario':28} {'conc':>4} {'reqs':>5} {'errs':>5} {'rps':>8} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttfb p50':>9} {'ttfb p95':>9}")
+
+def print_row(r):
+    rps = f"{r['throughput_rps']:8.2f}" if r["throughput_rps"] is not None else f"{'-':>8}"
+    print(f"{r['scenario']:28} {r['concurrency']:>4} {r['requests']:>5} {r['errors']:>5} {rps} "
+          f"{fmt(r['latency_ms']['p50'])} {fmt(r['latency_ms']['p95'])} {fmt(r['latency_ms']['p99'])} "
+          f"{fmt(r['ttfb_ms']['p50'])} {fmt(r['ttfb_ms']['p95'])}")
+
+def git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def wait_until_ready(url, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before becoming ready")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+def start_servers(args, stub_args, workdir):
+    """Starts the stubs and the API server; returns their processes, API server last."""
+    log = open(os.path.join(workdir, "server.log"), "w")
+    stubs = []
+    # The first stub serves every upstream; the others only stand in for more Ollama servers
+    for i in range(args.ollama_instances):
+        stubs.append(subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "stubs.py"), "--port", str(args.stub_port + i),
+             "--bolt-port", str(args.bolt_port if i == 0 else 0), *stub_args],
+            stdout=log, stderr=subprocess.STDOUT,
+        ))
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    env = {
+        **os.environ,
+        "OLLAMA_URLS": ",".join(f"http://127.0.0.1:{args.stub_port + i}" for i in range(args.ollama_instances)),
+        "NOMINATIM_URL": stub_url,
+        "PLACES_URL": stub_url,
+        "WEATHER_URL": stub_url,
+        "NEO4J_URI": f"bolt://127.0.0.1:{args.bolt_port}",
+        "CACHE_DB_PATH": os.path.join(workdir, "cache.sqlite3"),
+    }
+    # The stubs have no usage policy or offline index to respect
+    env.setdefault("NOMINATIM_RATE_LIMIT", "0")
+    env.setdefault("GAZETTEER_PATH", os.path.join(workdir, "no-gazetteer.bin"))
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        for i, stub in enumerate(stubs):
+            wait_until_ready(f"http://127.0.0.1:{args.stub_port + i}/stub_stats", stub)
+        wait_until_ready(f"http://127.0.0.1:{args.port}/cache_stats", api)
+    except RuntimeError:
+        stop_servers(*stubs, api)
+        raise
+    return (*stubs, api)
+
+def stop_servers(*processes):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def compare(before_path, after_path):
+    """Prints the change in latency and throughput between two result files."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    baseline = {(r["scenario"], r["concurrency"]): r for r in before["results"]}
+    print(f"{before.get('revision')} -> {after.get('revision')}")
+    print(f"{'scenario':28} {'conc':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>9} {'errors':>9}")
+
+    def change(old, new):
+        if old is None or new is None or old == 0:
+            return f"{'-':>9}"
+        return f"{(new - old) / old:+9.1%}"
+
+    for r in after["results"]:
+        old = baseline.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+        print(f"{r['scenario']:28} {r['concurrency']:>4} "
+              + " ".join(change(old["latency_ms"][p], r["latency_ms"][p]) for p in ("p50", "p95", "p99"))
+              + f" {change(old['throughput_rps'], r['throughput_rps'])}"
+              + f" {old['errors']:>4}->{r['errors']:<4}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        epilog="Any other options are passed to bench/stubs.py (see python bench/stubs.py --help).",
+        allow_abbrev=False,
+    )
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS,
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per scenario and level")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before each scenario")
+    parser.add_argument("--port", type=int, default=8800, help="Port for the API server under test")
+    parser.add_argument("--stub-port", type=int, default=8900)
+    parser.add_argument("--bolt-port", type=int, default=8687)
+    parser.add_argument("--ollama-instances", type=int, default=1,
+                        help="Ollama stubs to start on consecutive ports from --stub-port, all in OLLAMA_URLS")
+    parser.add_argument("--target", help="Benchmark an already running server at this URL instead")
+    parser.add_argument("--output", default="load_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compare two result files instead of running")
+    args, stub_args = parser.parse_known_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    with tempfile.TemporaryDirectory(prefix="tour-bench-") as workdir:
+        processes = ()
+        base_url = args.target
+        if not base_url:
+            processes = start_servers(args, stub_args, workdir)
+            base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            print_header()
+            results, server = asyncio.run(run_benchmark(base_url, scenarios, levels, args.requests, args.warmup))
+            stubs = {}
+            if processes:
+                stubs = httpx.get(f"http://127.0.0.1:{args.stub_port}/stub_stats").json()
+        finally:
+            stop_servers(*processes)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "settings": {
+                "scenarios": scenarios,
+                "concurrency": levels,
+                "requests": args.requests,
+                "warmup": args.warmup,
+                "target": args.target,
+                "stub_args": stub_args,
+                "ollama_instances": args.ollama_instances,
+            },
+            "results": results,
+            "server": server,
+            "stubs": stubs,
+        }, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+if __name__ == "__main__":
+    main()
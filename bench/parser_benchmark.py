@@ -0,0 +1,107 @@
+"""Compares the stop parser against the original DOTALL regex.
+
+Runs every recorded LLM output in bench/corpus plus generated adversarial
+inputs through both parsers and reports parse time and stop recall.
+
+    python bench/parser_benchmark.py [--repeat 5] [--output parser_results.json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stop_parser import parse_stops  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+
+# The pattern extract_stops_from_response used before the incremental parser
+LEGACY_PATTERN = re.compile(
+    r"\d+\.\s*Stop Name:\s*(.+?)\n\s*- Address:\s*(.+?)\n\s*- Time:\s*(\d{1,2}:\d{2} [AP]M)\s*-\s*(\d{1,2}:\d{2} [AP]M)\n\s*- Activity:\s*(.+?)\n\s*- Travel Method:\s*(.+?)\n\s*- Travel Time:\s*(\d+ minutes)\n\s*- Cost:\s*([^\n]*)",
+    re.DOTALL
+)
+
+def legacy_parse(text):
+    return [match.groups() for match in LEGACY_PATTERN.finditer(text)]
+
+def unterminated_stops(count):
+    """Stops whose travel time drifts from 'NN minutes', so the legacy pattern never closes."""
+    block = (
+        "{n}. Stop Name: Landmark {n}\n"
+        "   - Address: {n} Main Street\n"
+        "   - Time: 9:00 AM - 10:00 AM\n"
+        "   - Activity: Look around.\n"
+        "   - Travel Method: Walk\n"
+        "   - Travel Time: about an hour\n"
+    )
+    return "".join(block.format(n=n) for n in range(1, count + 1)), count
+
+def long_single_line(length):
+    """One enormous line with no newline, as produced by a runaway generation."""
+    return "1. Stop Name: " + "word " * length, 1
+
+def repeated_headers(count):
+    """Stop headers with no names or fields."""
+    return "1. Stop Name:\n - Address:\n" * count, 0
+
+def load_corpus():
+    with open(os.path.join(CORPUS_DIR, "expected.json")) as f:
+        expected = json.load(f)
+    cases = []
+    for filename, stops in sorted(expected.items()):
+        with open(os.path.join(CORPUS_DIR, filename), encoding="utf-8") as f:
+            cases.append((filename, f.read(), stops))
+    # The legacy pattern's cost grows polynomially with these sizes (16 stops or
+    # 100 headers already take about a second), so they are kept deliberately small.
+    cases.append(("adversarial/unterminated_8", *unterminated_stops(8)))
+    cases.append(("adversarial/unterminated_16", *unterminated_stops(16)))
+    cases.append(("adversarial/long_line_200k", *long_single_line(200_000)))
+    cases.append(("adversarial/repeated_headers_50", *repeated_headers(50)))
+    cases.append(("adversarial/repeated_headers_100", *repeated_headers(100)))
+    return cases
+
+def best_time(parse, text, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        stops = parse(text)
+        timings.append(time.perf_counter() - started)
+    return min(timings), len(stops)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'case':36} {'bytes':>8} {'expected':>8} {'legacy':>14} {'parser':>14}")
+    for name, text, expected in load_corpus():
+        legacy_seconds, legacy_found = best_time(legacy_parse, text, args.repeat)
+        parser_seconds, parser_found = best_time(parse_stops, text, args.repeat)
+        results.append({
+            "case": name,
+            "bytes": len(text.encode("utf-8")),
+            "expected_stops": expected,
+            "legacy": {"seconds": legacy_seconds, "stops": legacy_found},
+            "parser": {"seconds": parser_seconds, "stops": parser_found},
+        })
+        print(f"{name:36} {len(text):>8} {expected:>8} "
+              f"{legacy_found:>3} {legacy_seconds * 1000:>8.2f}ms "
+              f"{parser_found:>3} {parser_seconds * 1000:>8.2f}ms")
+
+    def recall(key):
+        expected = sum(r["expected_stops"] for r in results)
+        found = sum(min(r[key]["stops"], r["expected_stops"]) for r in results)
+        return found / expected if expected else 1.0
+
+    print(f"\nStop recall: legacy {recall('legacy'):.1%}, parser {recall('parser'):.1%}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "recall": {
+                "legacy": recall("legacy"), "parser": recall("parser")}}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
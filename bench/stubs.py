@@ -0,0 +1,392 @@
+"""Local stand-ins for every upstream main.py talks to, for offline benchmarks.
+
+One HTTP server answers for Ollama, Nominatim, Google Places and
+OpenWeatherMap (their paths do not overlap), and a minimal Bolt server
+accepts the Neo4j writes. Each upstream has its own latency, jitter and
+error rate. Ollama replays the recorded itineraries in bench/corpus token by
+token at a configurable rate.
+
+    python bench/stubs.py [--port 8900] [--bolt-port 8687] [--ollama-latency 0.3]
+
+Point the server at it with OLLAMA_URL, NOMINATIM_URL, PLACES_URL and
+WEATHER_URL set to http://127.0.0.1:8900 and NEO4J_URI=bolt://127.0.0.1:8687.
+Extra Ollama instances for OLLAMA_URLS can run on other ports with --bolt-port 0.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import struct
+import sys
+import time
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stop_parser import parse_stops  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+UPSTREAMS = ("ollama", "nominatim", "places", "weather", "neo4j")
+
+# Approximate centres for the corpus cities; other cities get a stable made-up one
+CITY_CENTRES = {
+    "paris": (48.8566, 2.3522),
+    "rome": (41.9028, 12.4964),
+    "new york": (40.7128, -74.0060),
+    "jaipur": (26.9124, 75.7873),
+    "mumbai": (19.0760, 72.8777),
+}
+
+TOKEN_PATTERN = re.compile(r"\s*\S+")
+TOTAL_COST_PATTERN = re.compile(r"total (?:estimated )?cost:\s*(.+)", re.IGNORECASE)
+
+def load_recordings():
+    """Returns {city: text} for every recorded itinerary in the corpus."""
+    recordings = {}
+    for filename in sorted(os.listdir(CORPUS_DIR)):
+        if filename.endswith(".txt"):
+            with open(os.path.join(CORPUS_DIR, filename), encoding="utf-8") as f:
+                city = filename.split("_", 1)[0].replace("newyork", "new york")
+                recordings[city] = f.read()
+    return recordings
+
+def as_json_output(text):
+    """Turns a recorded text itinerary into the JSON a schema-constrained model would return."""
+    total = TOTAL_COST_PATTERN.search(text)
+    output = {"stops": [{key: value for key, value in stop.items() if value is not None} for stop in parse_stops(text)]}
+    if total:
+        output["total_cost"] = total.group(1).strip()
+    return json.dumps(output)
+
+# Edit prompts ask for one stop to replace another (see build_edit_prompt in main.py)
+EDIT_MARKER = "Suggest one replacement stop"
+REPLACEMENTS = {
+    "market": "Central Food Market",
+    "food": "Central Food Market",
+    "museum": "City Museum",
+    "park": "Botanical Garden",
+    "garden": "Botanical Garden",
+    "coffee": "Historic Café",
+    "cafe": "Historic Café",
+}
+
+def replacement_stop(recording, prompt, city):
+    """Answers an edit prompt with one stop that is not already in the itinerary, in the same time slot."""
+    slot = re.search(r"from (\d{1,2}:\d{2}(?: ?[AP]M)?) - (\d{1,2}:\d{2}(?: ?[AP]M)?)", prompt)
+    request = re.search(r"Requested change: (.*?)\. It must", prompt)
+    instruction = request.group(1) if request else ""
+    unused = [stop for stop in parse_stops(recording) if stop["name"].split(",")[0] not in prompt]
+    name = unused[0]["name"].split(",")[0] if unused else next(
+        (place for keyword, place in REPLACEMENTS.items() if keyword in instruction.lower()), "Old Town Walk")
+    return (
+        f"1. Stop Name: {name}, {city.title()}\n"
+        f"   - Address: {name}, {city.title()}\n"
+        f"   - Time: {slot.group(1) if slot else '11:00 AM'} - {slot.group(2) if slot else '12:00 PM'}\n"
+        f"   - Activity: {instruction or 'Explore the area'}\n"
+        "   - Travel Method: Walk\n"
+        "   - Travel Time: 15 minutes\n"
+        "   - Cost: 10 Euros\n"
+    )
+
+def json_tokens(text):
+    """Splits JSON output into pieces of a few characters, roughly like a tokenizer."""
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+def stable_fraction(text):
+    """Maps text to a repeatable number in [0, 1)."""
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16) / 2**32
+
+def coordinates_for(query):
+    """Places a query a few kilometres from its city's centre, the same way every time."""
+    lowered = query.lower()
+    centre = next((c for city, c in CITY_CENTRES.items() if city in lowered), None)
+    if centre is None:
+        centre = (stable_fraction(lowered) * 120 - 60, stable_fraction(lowered[::-1]) * 360 - 180)
+    if lowered.strip() in CITY_CENTRES:
+        return centre
+    return (centre[0] + (stable_fraction(lowered + "lat") - 0.5) * 0.06,
+            centre[1] + (stable_fraction(lowered + "lon") - 0.5) * 0.06)
+
+class Upstream:
+    """Latency and failure behaviour of one stubbed service."""
+
+    def __init__(self, latency=0.0, jitter=0.5, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+
+    async def delay(self):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def fails(self):
+        self.requests += 1
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+def create_app(upstreams, tokens_per_second=40.0, prompt_tokens_per_second=0.0):
+    app = FastAPI()
+    recordings = load_recordings()
+    cities = sorted(recordings)
+    counters = Counter()
+
+    def error(name):
+        return JSONResponse({"error": f"stubbed {name} failure"}, status_code=503)
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        upstream = upstreams["ollama"]
+        body = await request.json()
+        prompt = body.get("prompt", "")
+        if upstream.fails():
+            return error("ollama")
+        if not prompt:
+            # An empty prompt only loads the model
+            return {"model": body.get("model"), "response": "", "done": True, "done_reason": "load"}
+        # Tokens passed back as `context` are assumed to still be in the KV cache, so only
+        # the new prompt is evaluated
+        context = body.get("context") or []
+        prompt_tokens = len(TOKEN_PATTERN.findall(prompt))
+        prompt_seconds = prompt_tokens / prompt_tokens_per_second if prompt_tokens_per_second > 0 else 0.0
+        if body.get("stream") is False:
+            started = time.perf_counter()
+            await upstream.delay()
+            await asyncio.sleep(prompt_seconds)
+            prompt_duration = time.perf_counter() - started
+            return {
+                "model": body.get("model"),
+                "response": "OK",
+                "done": True,
+                "done_reason": "stop",
+                "context": context + list(range(prompt_tokens + 1)),
+                "total_duration": int(prompt_duration * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_duration * 1e9),
+                "eval_count": 1,
+                "eval_duration": 0,
+            }
+        lowered = prompt.lower()
+        # The requested city comes first; later mentions are the format's examples
+        mentioned = [c for c in cities if c in lowered]
+        city = min(mentioned, key=lowered.find) if mentioned else cities[counters["ollama"] % len(cities)]
+        counters["ollama"] += 1
+        text = recordings[city]
+        if EDIT_MARKER in prompt:
+            text = replacement_stop(text, prompt, city)
+        if body.get("format"):
+            tokens = json_tokens(as_json_output(text))
+        else:
+            tokens = TOKEN_PATTERN.findall(text)
+        limit = (body.get("options") or {}).get("num_predict")
+        truncated = bool(limit) and 0 < limit < len(tokens)
+        if truncated:
+            tokens = tokens[:limit]
+
+        async def stream():
+            started = time.perf_counter()
+            await upstream.delay()               # prompt evaluation before the first token
+            await asyncio.sleep(prompt_seconds)
+            prompt_done = time.perf_counter()
+            for token in tokens:
+                yield json.dumps({"model": body.get("model"), "response": token, "done": False}) + "\n"
+                if tokens_per_second > 0:
+                    await asyncio.sleep(1 / tokens_per_second)
+            finished = time.perf_counter()
+            yield json.dumps({
+                "model": body.get("model"),
+                "response": "",
+                "done": True,
+                "done_reason": "length" if truncated else "stop",
+                "total_duration": int((finished - started) * 1e9),
+                "context": context + list(range(prompt_tokens + len(tokens))),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int((prompt_done - started) * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int((finished - prompt_done) * 1e9),
+            }) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.get("/api/tags")
+    async def tags():
+        """Health check: lists the one pretend model."""
+        return {"models": [{"name": "stub", "model": "stub"}]}
+
+    @app.get("/search")
+    async def search(q: str = ""):
+        upstream = upstreams["nominatim"]
+        await upstream.delay()
+        if upstream.fails():
+            return error("nominatim")
+        lat, lon = coordinates_for(q)
+        return [{"lat": f"{lat:.7f}", "lon": f"{lon:.7f}", "display_name": q}]
+
+    @app.get("/maps/api/place/textsearch/json")
+    async def places(query: str = ""):
+        upstream = upstreams["places"]
+        await upstream.delay()
+        if upstream.fails():
+            return error("places")
+        city = query.replace("popular places in", "").strip()
+        names = ["Old Town", "Central Museum", "Cathedral", "Botanical Garden", "Market Hall", "Riverside Walk"]
+        return {"results": [{"name": f"{name}, {city}"} for name in names], "status": "OK"}
+
+    @app.get("/data/2.5/weather")
+    async def weather(q: str = ""):
+        upstream = upstreams["weather"]
+        await upstream.delay()
+        if upstream.fails():
+            return error("weather")
+        return {
+            "weather": [{"description": "scattered clouds"}],
+            "main": {"temp": round(5 + stable_fraction(q.lower()) * 25, 1)},
+            "name": q,
+        }
+
+    @app.get("/stub_stats")
+    async def stub_stats():
+        """Requests and injected errors per upstream since the stubs started."""
+        return {name: {"requests": u.requests, "errors": u.errors} for name, u in upstreams.items()}
+
+    return app
+
+# --- Bolt --------------------------------------------------------------------
+# Just enough of Bolt 4.4 for the driver to connect, run writes and reset:
+# every request is answered with SUCCESS (or FAILURE at the configured rate).
+
+BOLT_MAGIC = b"\x60\x60\xb0\x17"
+BOLT_VERSION = b"\x00\x00\x04\x04"
+HELLO, GOODBYE, RESET, RUN, BEGIN, COMMIT, ROLLBACK, DISCARD, PULL, ROUTE = (
+    0x01, 0x02, 0x0F, 0x10, 0x11, 0x12, 0x13, 0x2F, 0x3F, 0x66)
+SUCCESS, IGNORED, FAILURE = 0x70, 0x7E, 0x7F
+
+def pack(value):
+    """Encodes the few PackStream types the stub replies with."""
+    if value is None:
+        return b"\xc0"
+    if isinstance(value, bool):
+        return b"\xc3" if value else b"\xc2"
+    if isinstance(value, int):
+        if -16 <= value < 128:
+            return struct.pack(">b", value)
+        return b"\xcb" + struct.pack(">q", value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        if len(data) < 16:
+            return bytes([0x80 | len(data)]) + data
+        if len(data) < 256:
+            return b"\xd0" + bytes([len(data)]) + data
+        return b"\xd1" + struct.pack(">H", len(data)) + data
+    if isinstance(value, list):
+        return bytes([0x90 | len(value)]) + b"".join(pack(item) for item in value)
+    if isinstance(value, dict):
+        return bytes([0xA0 | len(value)]) + b"".join(pack(k) + pack(v) for k, v in value.items())
+    raise TypeError(f"cannot pack {type(value).__name__}")
+
+def bolt_message(signature, metadata):
+    data = b"\xb1" + bytes([signature]) + pack(metadata)
+    return struct.pack(">H", len(data)) + data + b"\x00\x00"
+
+async def read_message(reader):
+    data = b""
+    while True:
+        size = struct.unpack(">H", await reader.readexactly(2))[0]
+        if size == 0:
+            if data:
+                return data
+            continue                              # NOOP keep-alive chunk
+        data += await reader.readexactly(size)
+
+def bolt_handler(upstream):
+    connection_ids = iter(range(1, 2**31))
+
+    async def handle(reader, writer):
+        try:
+            if await reader.readexactly(4) != BOLT_MAGIC:
+                return
+            await reader.readexactly(16)
+            writer.write(BOLT_VERSION)
+            connection_id = f"bolt-{next(connection_ids)}"
+            failed = False
+            while True:
+                signature = (await read_message(reader))[1]
+                if signature == GOODBYE:
+                    return
+                if signature == RESET:
+                    failed = False
+                    reply = bolt_message(SUCCESS, {})
+                elif failed:
+                    reply = bolt_message(IGNORED, {})
+                elif signature == HELLO:
+                    reply = bolt_message(SUCCESS, {"server": "Neo4j/4.4.0", "connection_id": connection_id})
+                elif signature == RUN and upstream.fails():
+                    failed = True
+                    reply = bolt_message(FAILURE, {
+                        "code": "Neo.TransientError.General.DatabaseUnavailable",
+                        "message": "stubbed neo4j failure",
+                    })
+                elif signature == RUN:
+                    await upstream.delay()
+                    reply = bolt_message(SUCCESS, {"fields": [], "t_first": 0})
+                elif signature in (PULL, DISCARD):
+                    reply = bolt_message(SUCCESS, {"type": "w", "t_last": 0, "db": "neo4j"})
+                elif signature == COMMIT:
+                    reply = bolt_message(SUCCESS, {"bookmark": f"stub:{connection_id}"})
+                else:
+                    reply = bolt_message(SUCCESS, {})
+                writer.write(reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stand-ins for Ollama, Nominatim, Places, Weather and Neo4j.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900, help="HTTP port shared by the HTTP stubs")
+    parser.add_argument("--bolt-port", type=int, default=8687, help="Port of the Neo4j Bolt stub (0 = none)")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="Ollama generation speed (0 = no delay)")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=0.0,
+                        help="Ollama prompt evaluation speed, added to --ollama-latency (0 = no extra delay)")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Latency varies uniformly by this fraction")
+    defaults = {"ollama": 0.3, "nominatim": 0.15, "places": 0.2, "weather": 0.1, "neo4j": 0.01}
+    for name in UPSTREAMS:
+        parser.add_argument(f"--{name}-latency", type=float, default=defaults[name],
+                            help=f"Mean {name} latency in seconds (time to first token for ollama)")
+        parser.add_argument(f"--{name}-error-rate", type=float, default=0.0,
+                            help=f"Fraction of {name} requests that fail")
+    parser.add_argument("--seed", type=int, help="Seed the latency and error randomness")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    upstreams = {
+        name: Upstream(getattr(args, f"{name}_latency"), args.jitter, getattr(args, f"{name}_error_rate"))
+        for name in UPSTREAMS
+    }
+    app = create_app(upstreams, args.tokens_per_second, args.prompt_tokens_per_second)
+
+    @app.on_event("startup")
+    async def start_bolt():
+        if not args.bolt_port:
+            return
+        app.state.bolt = await asyncio.start_server(bolt_handler(upstreams["neo4j"]), args.host, args.bolt_port)
+        print(f"Neo4j Bolt stub listening on {args.host}:{args.bolt_port}")
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
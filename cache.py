@@ -0,0 +1,158 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by SQLiteCache.get when a key has no live entry. A stored value of
+# None is a negative entry ("looked up, nothing found") and is returned as None.
+MISSING = object()
+
+def normalize_key(text):
+    """Normalizes free text for use as a cache key: lowercase, single spaces, tidy commas."""
+    text = " ".join(str(text).lower().split())
+    return re.sub(r"\s*,\s*", ", ", text).strip(" ,")
+
+class SQLiteCache:
+    """Disk-backed key/value cache with per-entry TTL, LRU eviction and hit/miss counters."""
+
+    def __init__(self, path, table, max_entries=10000, ttl=86400):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT, expires_at REAL, last_access REAL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_lru ON {table} (last_access)")
+        self._size = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def get(self, key):
+        """Returns the cached value for key, or MISSING if absent or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return MISSING
+            if row[1] <= now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._size -= 1
+                self.misses += 1
+                return MISSING
+            self._conn.execute(
+                f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key)
+            )
+        value = json.loads(row[0])
+        if value is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Stores value under key; a value of None records a negative entry."""
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            exists = self._conn.execute(
+                f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+            if not exists:
+                self._size += 1
+            if self._size > self.max_entries:
+                self._evict(self._size - self.max_entries)
+
+    def expires_in(self, key):
+        """Returns seconds until key expires, or None if it is absent or already expired."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        return row[0] - time.time()
+
+    def _evict(self, count):
+        """Drops the `count` least recently used entries. Caller holds the lock."""
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN "
+            f"(SELECT key FROM {self.table} ORDER BY last_access LIMIT ?)",
+            (count,),
+        )
+        self._size -= count
+        self.evictions += count
+
+    def stats(self):
+        """Returns hit/miss counters and current size for cache sizing."""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": self._size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+class MemoryCache:
+    """In-process cache with a freshness TTL, a stale-while-revalidate window and LRU eviction."""
+
+    def __init__(self, max_entries=1000, ttl=600, stale_ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Returns (value, state) where state is 'fresh', 'stale' or 'miss'."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1], "fresh"
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                return entry[1], "stale"
+            del self._entries[key]
+        self.misses += 1
+        return MISSING, "miss"
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
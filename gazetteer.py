@@ -0,0 +1,192 @@
+"""Offline place index used as the first geocoding tier.
+
+Build a compact index from a GeoNames extract (tab-separated, e.g.
+allCountries.txt or a country file from https://download.geonames.org/export/dump/):
+
+    python gazetteer.py build data/gazetteer_sample.tsv gazetteer.bin
+    python gazetteer.py lookup gazetteer.bin "Eiffel Tower" Paris
+
+The index is a single file that is memory-mapped read-only. It holds
+fixed-size records sorted by normalized name, followed by a blob of the
+names themselves, so lookups are binary searches over the mapping and
+nothing is parsed or loaded up front.
+"""
+import argparse
+import difflib
+import math
+import mmap
+import struct
+import unicodedata
+
+MAGIC = b"GAZ1"
+HEADER = struct.Struct("<4sII")        # magic, record count, offset of the names blob
+RECORD = struct.Struct("<IHffIB")      # name offset, name length, lat, lon, population, flags
+
+FLAG_SETTLEMENT = 1                    # GeoNames feature class P (city, town, village)
+
+# GeoNames column positions
+NAME, ASCIINAME, LATITUDE, LONGITUDE, FEATURE_CLASS, POPULATION = 1, 2, 4, 5, 6, 14
+
+def normalize_name(text):
+    """Lowercases, strips accents and punctuation, and collapses whitespace."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = "".join(ch if ch.isalnum() else " " if ch in " -,/&" else "" for ch in text.lower())
+    return " ".join(text.split())
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 12742 * math.asin(math.sqrt(a))
+
+def build(source_path, index_path):
+    """Builds an index file from a GeoNames dump; returns the number of records written."""
+    entries = {}
+    with open(source_path, encoding="utf-8") as source:
+        for line in source:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) <= POPULATION or line.startswith("#"):
+                continue
+            flags = FLAG_SETTLEMENT if columns[FEATURE_CLASS] == "P" else 0
+            record = (float(columns[LATITUDE]), float(columns[LONGITUDE]),
+                      int(columns[POPULATION] or 0), flags)
+            for name in {columns[NAME], columns[ASCIINAME]}:
+                key = normalize_name(name)
+                if key:
+                    entries.setdefault(key.encode("utf-8"), []).append(record)
+
+    records = bytearray()
+    names = bytearray()
+    count = 0
+    for key in sorted(entries):
+        offset = len(names)
+        names += key
+        for lat, lon, population, flags in entries[key]:
+            records += RECORD.pack(offset, len(key), lat, lon, min(population, 2**32 - 1), flags)
+            count += 1
+
+    with open(index_path, "wb") as index:
+        index.write(HEADER.pack(MAGIC, count, HEADER.size + len(records)))
+        index.write(records)
+        index.write(names)
+    return count
+
+class Gazetteer:
+    """Read-only, memory-mapped place index with exact, prefix and fuzzy lookup."""
+
+    def __init__(self, path, city_radius_km=30.0, fuzzy_cutoff=0.85, max_scan=2000, min_match_length=5):
+        self.city_radius_km = city_radius_km
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.min_match_length = min_match_length   # shortest name tried by inexact matching
+        self.max_scan = max_scan
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self._names_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a gazetteer index")
+
+    def close(self):
+        self._map.close()
+
+    def _record(self, i):
+        offset, length, lat, lon, population, flags = RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)
+        start = self._names_offset + offset
+        return self._map[start:start + length], lat, lon, population, flags
+
+    def _lower_bound(self, key):
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._record(mid)[0] < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _scan(self, prefix):
+        """Yields records whose name starts with prefix, in name order."""
+        i = self._lower_bound(prefix)
+        for i in range(i, min(self.count, i + self.max_scan)):
+            record = self._record(i)
+            if not record[0].startswith(prefix):
+                return
+            yield record
+
+    def city(self, city):
+        """Returns (lat, lon) of the most populous settlement named city, or None."""
+        key = normalize_name(city).encode("utf-8")
+        settlements = [r for r in self._scan(key) if r[0] == key and r[4] & FLAG_SETTLEMENT]
+        if not settlements:
+            return None
+        _, lat, lon, _, _ = max(settlements, key=lambda r: r[3])
+        return round(lat, 6), round(lon, 6)
+
+    def lookup(self, place_name, city):
+        """Finds a place within the city's radius by exact, then prefix, then fuzzy name match.
+
+        Only an exact match may return a settlement; inexact matches need at least
+        `min_match_length` characters and must name something other than a town.
+        """
+        center = self.city(city)
+        if center is None:
+            return None
+        name = normalize_name(place_name)
+        city_key = normalize_name(city)
+        if name.endswith(" " + city_key):       # "Eiffel Tower, Paris" -> "eiffel tower"
+            name = name[:-len(city_key) - 1]
+        if not name or name == city_key:
+            return center
+        key = name.encode("utf-8")
+        city_bytes = city_key.encode("utf-8")
+
+        def nearby(records):
+            return [r for r in records if haversine_km(center[0], center[1], r[1], r[2]) <= self.city_radius_km]
+
+        def landmarks(records):
+            # Inexact matches must not fall back to the city itself ("Paris Opera" -> "Paris")
+            # or to another settlement, which would pass the city centre off as the place
+            return (r for r in records if r[0] != city_bytes and not r[4] & FLAG_SETTLEMENT)
+
+        candidates = nearby(r for r in self._scan(key) if r[0] == key)
+        if not candidates and len(key) >= self.min_match_length:
+            candidates = nearby(landmarks(self._scan(key)))
+        words = name.split()
+        while not candidates and len(words) > 1:
+            # "Louvre Museum" -> "Louvre": drop trailing descriptive words
+            words.pop()
+            shorter = " ".join(words).encode("utf-8")
+            if len(shorter) >= self.min_match_length:
+                candidates = nearby(landmarks(r for r in self._scan(shorter) if r[0] == shorter))
+        if not candidates and len(key) >= self.min_match_length:
+            # Fuzzy: same leading characters, closest spelling above the cutoff
+            scored = []
+            for record in nearby(landmarks(self._scan(key[:3]))):
+                score = difflib.SequenceMatcher(None, key, record[0]).ratio()
+                if score >= self.fuzzy_cutoff:
+                    scored.append((score, record))
+            candidates = [max(scored, key=lambda s: s[0])[1]] if scored else []
+        if not candidates:
+            return None
+        _, lat, lon, _, _ = min(candidates, key=lambda r: haversine_km(center[0], center[1], r[1], r[2]))
+        return round(lat, 6), round(lon, 6)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the offline gazetteer.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_command = commands.add_parser("build", help="Build an index from a GeoNames dump")
+    build_command.add_argument("source")
+    build_command.add_argument("index")
+    lookup_command = commands.add_parser("lookup", help="Look up a place in an index")
+    lookup_command.add_argument("index")
+    lookup_command.add_argument("place")
+    lookup_command.add_argument("city")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build(args.source, args.index)
+        print(f"Wrote {count} records to {args.index}")
+    else:
+        print(Gazetteer(args.index).lookup(args.place, args.city))
+
+if __name__ == "__main__":
+    main()
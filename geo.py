@@ -0,0 +1,55 @@
+def encode_polyline(coordinates, precision=5):
+    """Encodes (lat, lon) pairs with the Google encoded polyline algorithm."""
+    factor = 10 ** precision
+    output = []
+    prev_lat = prev_lon = 0
+    for lat, lon in coordinates:
+        lat_i, lon_i = round(lat * factor), round(lon * factor)
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return "".join(output)
+
+def decode_polyline(encoded, precision=5):
+    """Decodes an encoded polyline back into a list of (lat, lon) pairs."""
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coordinates.append((lat / factor, lon / factor))
+    return coordinates
+
+def to_feature_collection(map_data, precision=5):
+    """Converts map_data entries into a GeoJSON FeatureCollection plus an encoded route."""
+    features = []
+    for entry in map_data:
+        lat, lon = entry["coordinates"]
+        properties = {key: value for key, value in entry.items() if key != "coordinates"}
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lon, precision), round(lat, precision)]},
+            "properties": properties,
+        })
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "route": encode_polyline([entry["coordinates"] for entry in map_data], precision),
+        "precision": precision,
+    }
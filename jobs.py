@@ -0,0 +1,220 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import deque
+
+# Lower runs first: people waiting on a page before bulk and speculative work
+PRIORITIES = {"interactive": 0, "batch": 1, "prefetch": 2}
+
+FINISHED = ("done", "failed", "cancelled")
+
+def worker_cancelling():
+    """True if the current task has a cancellation pending (Python 3.11+; False before)."""
+    task = asyncio.current_task()
+    return bool(getattr(task, "cancelling", lambda: 0)())
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Job:
+    """A queued unit of work whose status and partial results can be polled."""
+
+    def __init__(self, payload, priority):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.priority = priority
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.partial = {}
+        self.result = None
+        self.error = None
+        self.version = 0
+        self._changed = asyncio.Event()
+        self._task = None
+        self._cancel_requested = False
+
+    def update(self, **partial):
+        """Merges partial results and wakes anyone long-polling this job."""
+        self.partial.update(partial)
+        self._notify()
+
+    def _notify(self):
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, after_version, timeout):
+        """Waits until the job changes past `after_version`, finishes, or `timeout` seconds pass."""
+        if self.version > after_version or self.status in FINISHED or timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def view(self, position=None):
+        finished = self.status in FINISHED
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "version": self.version,
+            "position": position,
+            "wait_ms": round(((self.started_at or self.finished_at or time.time()) - self.created_at) * 1000, 1),
+            "run_ms": round(((self.finished_at or time.time()) - self.started_at) * 1000, 1) if self.started_at else None,
+            "partial": None if finished else self.partial,
+            "result": self.result,
+            "error": self.error,
+        }
+
+class JobQueue:
+    """Bounded priority queue served by a fixed pool of workers.
+
+    `run` is an async callable taking a Job; it may call job.update() with
+    partial results and returns the final result. At most `max_queued` jobs
+    wait at once; finished jobs are kept for `retention` seconds.
+    """
+
+    def __init__(self, run, workers=2, max_queued=100, retention=3600):
+        self.run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.jobs = {}
+        self.queue = asyncio.PriorityQueue()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.wait_times = deque(maxlen=1000)
+        self.run_times = deque(maxlen=1000)
+        self._order = itertools.count()
+        self._workers = []
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.monotonic()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def queued(self):
+        return sum(1 for job in self.jobs.values() if job.status == "queued")
+
+    def submit(self, payload, priority="interactive"):
+        """Queues a job, or raises JobQueueFull with a suggested retry delay in seconds."""
+        self._expire()
+        if self.queued() >= self.max_queued:
+            self.rejected += 1
+            raise JobQueueFull(f"{self.max_queued} jobs already queued", self.retry_after())
+        job = Job(payload, priority)
+        self.jobs[job.id] = job
+        self.queue.put_nowait((PRIORITIES[priority], next(self._order), job))
+        self.submitted += 1
+        return job
+
+    def position(self, job):
+        """1-based place of a queued job among those that will run before it, or None."""
+        if job.status != "queued":
+            return None
+        rank = (PRIORITIES[job.priority], job.created_at)
+        return 1 + sum(1 for other in self.jobs.values()
+                       if other.status == "queued" and other is not job
+                       and (PRIORITIES[other.priority], other.created_at) < rank)
+
+    def cancel(self, job):
+        """Cancels a queued or running job; returns False if it had already finished."""
+        if job.status in FINISHED:
+            return False
+        if job._task is not None:
+            job._cancel_requested = True
+            job._task.cancel()
+        else:
+            self._finish(job, "cancelled")
+        return True
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up, from recent run times."""
+        average = sum(self.run_times) / len(self.run_times) if self.run_times else 10.0
+        return max(1, round(average / self.workers))
+
+    async def _work(self):
+        while True:
+            _, _, job = await self.queue.get()
+            if job.status != "queued":
+                continue  # cancelled while waiting
+            job.status = "running"
+            job.started_at = time.time()
+            self.wait_times.append(job.started_at - job.created_at)
+            job._notify()
+            self.busy += 1
+            started = time.monotonic()
+            task = job._task = asyncio.ensure_future(self.run(job))
+            try:
+                job.result = await task
+                self._finish(job, "done")
+            except asyncio.CancelledError:
+                self._finish(job, "cancelled")
+                if not job._cancel_requested or worker_cancelling():
+                    raise  # the worker itself is shutting down
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                self._finish(job, "failed")
+            finally:
+                elapsed = time.monotonic() - started
+                self.busy -= 1
+                self.busy_seconds += elapsed
+                self.run_times.append(elapsed)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job._task = None
+        if status == "done":
+            self.completed += 1
+        elif status == "failed":
+            self.failed += 1
+        else:
+            self.cancelled += 1
+        job._notify()
+
+    def _expire(self):
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+        waits = sorted(self.wait_times)
+        depth = {name: 0 for name in PRIORITIES}
+        for job in self.jobs.values():
+            if job.status == "queued":
+                depth[job.priority] += 1
+        return {
+            "queued": sum(depth.values()),
+            "queued_by_priority": depth,
+            "max_queued": self.max_queued,
+            "running": self.busy,
+            "workers": self.workers,
+            "utilisation": round(self.busy_seconds / (self.workers * uptime), 3) if uptime else None,
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else None,
+            "p95_wait_ms": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 1) if waits else None,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+        }
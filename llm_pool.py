@@ -0,0 +1,225 @@
+import asyncio
+import itertools
+import time
+
+import httpx
+
+class Backend:
+    """One LLM server and its load and health bookkeeping."""
+
+    def __init__(self, url):
+        self.url = url
+        self.client = None
+        self.in_flight = 0
+        self.healthy = True
+        self.failures = 0          # consecutive
+        self.requests = 0
+        self.errors = 0
+        self.latency = None        # moving average of seconds to first line
+        self.last_error = None
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.failures,
+            "avg_first_line_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "last_error": self.last_error,
+        }
+
+class BackendPool:
+    """Routes requests to the least-loaded healthy backend, with failover and optional hedging.
+
+    A backend is evicted after `max_failures` consecutive failures and
+    rejoins when a health check (`health_path`, every `health_interval`
+    seconds) succeeds. Streams can be hedged: if no line has arrived after
+    `hedge_after` seconds, the request is also sent to another backend and
+    whichever answers first is used.
+    """
+
+    def __init__(self, urls, max_failures=3, health_interval=10.0, health_path="/api/tags"):
+        if not urls:
+            raise ValueError("BackendPool needs at least one backend URL")
+        self.backends = [Backend(url) for url in urls]
+        self.max_failures = max_failures
+        self.health_interval = health_interval
+        self.health_path = health_path
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._turn = itertools.count()
+        self._health_task = None
+
+    def start(self, make_client):
+        """Creates each backend's client with `make_client(url)` and starts health checks."""
+        for backend in self.backends:
+            backend.client = make_client(backend.url)
+        if self.health_interval > 0:
+            self._health_task = asyncio.ensure_future(self._check_health())
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+        for backend in self.backends:
+            if backend.client:
+                await backend.client.aclose()
+
+    def pick(self, exclude=()):
+        """Returns the healthy backend with the fewest requests in flight, or None."""
+        candidates = [b for b in self.backends if b.healthy and b not in exclude]
+        if not candidates:
+            # Everything is evicted: better to try a backend than to fail outright
+            candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        # Rotate the starting point so ties are spread instead of always hitting the first backend
+        offset = next(self._turn) % len(candidates)
+        rotated = candidates[offset:] + candidates[:offset]
+        return min(rotated, key=lambda b: b.in_flight)
+
+    def _succeeded(self, backend, elapsed):
+        backend.failures = 0
+        backend.healthy = True
+        backend.latency = elapsed if backend.latency is None else 0.8 * backend.latency + 0.2 * elapsed
+
+    def _failed(self, backend, error):
+        backend.errors += 1
+        backend.failures += 1
+        backend.last_error = repr(error)
+        if backend.failures >= self.max_failures and backend.healthy:
+            backend.healthy = False
+            print(f"Evicting LLM backend {backend.url} after {backend.failures} failures: {error!r}")
+
+    async def request(self, method, path, **kwargs):
+        """Sends a plain request, failing over to the next backend; re-raises the last error if all fail."""
+        tried = set()
+        error = None
+        while (backend := self.pick(exclude=tried)) is not None:
+            tried.add(backend)
+            backend.in_flight += 1
+            backend.requests += 1
+            started = time.perf_counter()
+            try:
+                response = await backend.client.request(method, path, **kwargs)
+                response.raise_for_status()
+                self._succeeded(backend, time.perf_counter() - started)
+                return response
+            except httpx.HTTPError as e:
+                self._failed(backend, e)
+                error = e
+            finally:
+                backend.in_flight -= 1
+        raise error
+
+    async def stream_lines(self, path, payload, hedge_after=None):
+        """Yields the lines of a streamed POST, from whichever backend produced a line first.
+
+        Close it with contextlib.aclosing() when stopping early, so the backend's slot is released.
+        """
+        backend, response, first, lines = await self._open(path, payload, hedge_after)
+        try:
+            if first:
+                yield first
+            async for line in lines:
+                yield line
+        except httpx.HTTPError as e:
+            self._failed(backend, e)
+            raise
+        finally:
+            backend.in_flight -= 1
+            await response.aclose()
+
+    async def _open(self, path, payload, hedge_after):
+        first_backend = self.pick()
+        tried = {first_backend}
+        pending = {asyncio.ensure_future(self._start(first_backend, path, payload))}
+        hedged = False
+        error = None
+        try:
+            while pending:
+                timeout = hedge_after if hedge_after and not hedged else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    backup = self.pick(exclude=tried)
+                    if backup is not None:
+                        self.hedges += 1
+                        tried.add(backup)
+                        pending.add(asyncio.ensure_future(self._start(backup, path, payload, hedge=True)))
+                    continue
+                opened = [task.result() for task in done if task.exception() is None]
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                if opened:
+                    winner, *losers = opened
+                    for backend, response, *_ in losers:
+                        backend.in_flight -= 1
+                        await response.aclose()
+                    if winner[-1]:
+                        self.hedge_wins += 1
+                    return winner[:-1]
+                if not pending:
+                    # Fail over to a backend that has not been tried yet
+                    backup = self.pick(exclude=tried)
+                    if backup is not None:
+                        tried.add(backup)
+                        pending.add(asyncio.ensure_future(self._start(backup, path, payload)))
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    async def _start(self, backend, path, payload, hedge=False):
+        """Sends the request and waits for its first non-empty line; cleans up if that fails."""
+        backend.in_flight += 1
+        backend.requests += 1
+        started = time.perf_counter()
+        response = None
+        try:
+            request = backend.client.build_request("POST", path, json=payload)
+            response = await backend.client.send(request, stream=True)
+            response.raise_for_status()
+            lines = response.aiter_lines()
+            first = ""
+            async for line in lines:
+                if line:
+                    first = line
+                    break
+            self._succeeded(backend, time.perf_counter() - started)
+            return backend, response, first, lines, hedge
+        except BaseException as e:
+            backend.in_flight -= 1
+            if response is not None:
+                await response.aclose()
+            if isinstance(e, httpx.HTTPError):
+                self._failed(backend, e)
+            raise
+
+    async def _check_health(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for backend in self.backends:
+                try:
+                    response = await backend.client.get(self.health_path, timeout=5)
+                    response.raise_for_status()
+                    if not backend.healthy:
+                        print(f"LLM backend {backend.url} is healthy again")
+                    backend.healthy = True
+                    backend.failures = 0
+                except httpx.HTTPError as e:
+                    backend.failures += 1
+                    backend.last_error = repr(e)
+                    if backend.failures >= self.max_failures and backend.healthy:
+                        backend.healthy = False
+                        print(f"Evicting LLM backend {backend.url} after failed health checks: {e!r}")
+
+    def stats(self):
+        return {
+            "backends": [backend.stats() for backend in self.backends],
+            "healthy": sum(backend.healthy for backend in self.backends),
+            "hedged_requests": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
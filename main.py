@@ -73,13 +73,32 @@
 
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from neo4j import GraphDatabase
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 import os
-import requests
+import httpx
 import json
 import re
+import time
+import asyncio
+import bisect
+import hashlib
+import uuid
+from collections import Counter
+from contextlib import aclosing, nullcontext
 from datetime import datetime
+from cache import SQLiteCache, MemoryCache, MISSING, normalize_key
+from stop_parser import StopParser, parse_stops
+from write_behind import WriteBehindQueue, QueueFull
+from geo import to_feature_collection
+from gazetteer import Gazetteer
+from routing import plan_route, parse_clock, reschedule
+from jobs import JobQueue, JobQueueFull, PRIORITIES
+from llm_pool import BackendPool
+from resilience import CircuitBreaker, CircuitOpen, call_with_retries
+import metrics
 
 app = FastAPI()
 
@@ -88,10 +107,394 @@ GOOGLE_PLACES_API_KEY = os.getenv("GOOGLE_PLACES_API_KEY")
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 
 # Neo4j driver initialization
-neo4j_driver = GraphDatabase.driver("neo4j://localhost:7687", auth=("neo4j", "attention.ai"))
+NEO4J_URI = os.getenv("NEO4J_URI", "neo4j://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "attention.ai")
+
+neo4j_driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+# Preference writes are queued and flushed to Neo4j in batches
+PREFERENCE_BATCH_SIZE = int(os.getenv("PREFERENCE_BATCH_SIZE", "200"))
+PREFERENCE_FLUSH_INTERVAL = float(os.getenv("PREFERENCE_FLUSH_INTERVAL", "0.5"))
+PREFERENCE_QUEUE_SIZE = int(os.getenv("PREFERENCE_QUEUE_SIZE", "10000"))
+PREFERENCE_ENQUEUE_TIMEOUT = float(os.getenv("PREFERENCE_ENQUEUE_TIMEOUT", "2"))
+
+# Offline place index queried before Nominatim (build with `python gazetteer.py build`)
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "gazetteer.bin")
+GAZETTEER_CITY_RADIUS_KM = float(os.getenv("GAZETTEER_CITY_RADIUS_KM", "30"))
+
+gazetteer = Gazetteer(GAZETTEER_PATH, GAZETTEER_CITY_RADIUS_KM) if os.path.exists(GAZETTEER_PATH) else None
+
+# Compact map_data: decimal places kept for coordinates and the encoded route
+MAP_COORDINATE_PRECISION = int(os.getenv("MAP_COORDINATE_PRECISION", "5"))
+MAP_FORMATS = ("full", "compact")
 
 # Ollama model settings
-OLLAMA_MODEL = "llama2"
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2")
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+# Several Ollama servers, comma-separated; each request goes to the least-loaded healthy one
+OLLAMA_URLS = [url.strip() for url in os.getenv("OLLAMA_URLS", OLLAMA_URL).split(",") if url.strip()]
+# Also send a generation to a second server when no token has arrived after this many seconds (0 disables)
+OLLAMA_HEDGE_AFTER = float(os.getenv("OLLAMA_HEDGE_AFTER", "0"))
+# A server is evicted after this many consecutive failures and rejoins once a health check passes
+OLLAMA_MAX_FAILURES = int(os.getenv("OLLAMA_MAX_FAILURES", "3"))
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+# How long Ollama keeps the model loaded after a request: a duration such as "30m", or seconds (-1 = forever)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE) if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit() else OLLAMA_KEEP_ALIVE
+# Upper bound on generated tokens per itinerary
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "1536"))
+# Load the model when the server starts instead of on the first request
+OLLAMA_WARM_UP = os.getenv("OLLAMA_WARM_UP", "1") == "1"
+# "text": numbered free-text stops parsed from the output; "json": schema-constrained JSON output
+ITINERARY_FORMAT = os.getenv("ITINERARY_FORMAT", "text")
+# Evaluate the constant format instructions once and reuse Ollama's returned context afterwards
+OLLAMA_PREFIX_CACHE = os.getenv("OLLAMA_PREFIX_CACHE", "1") == "1"
+
+# Upstream services, each served by its own pooled async HTTP client
+UPSTREAMS = {
+    "nominatim": {
+        "base_url": os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org"),
+        "headers": {"User-Agent": "tour-planning-app"},
+    },
+    "places": {"base_url": os.getenv("PLACES_URL", "https://maps.googleapis.com")},
+    "weather": {"base_url": os.getenv("WEATHER_URL", "http://api.openweathermap.org")},
+}
+
+# Connection pool sizes, overridable per upstream (e.g. OLLAMA_MAX_CONNECTIONS)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Requests per second allowed per upstream (0 disables the limit, e.g. NOMINATIM_RATE_LIMIT)
+UPSTREAM_RATE_LIMITS = {
+    "nominatim": float(os.getenv("NOMINATIM_RATE_LIMIT", "1")),
+    "places": float(os.getenv("PLACES_RATE_LIMIT", "0")),
+    "weather": float(os.getenv("WEATHER_RATE_LIMIT", "0")),
+}
+
+# Seconds to wait for a connection and for each read, overridable per upstream (e.g. NOMINATIM_READ_TIMEOUT)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+# Ollama can go quiet for a long time while it evaluates a prompt, so it gets its own default
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+
+# Retries of failed upstream calls, with backoff doubling from UPSTREAM_RETRY_BACKOFF up to the max (seconds)
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.25"))
+UPSTREAM_RETRY_MAX_BACKOFF = float(os.getenv("UPSTREAM_RETRY_MAX_BACKOFF", "2"))
+# Consecutive failures that open an upstream's circuit breaker, and seconds before it tries again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+http_clients = {}
+ollama_pool = BackendPool(OLLAMA_URLS, OLLAMA_MAX_FAILURES, OLLAMA_HEALTH_INTERVAL)
+
+# Prometheus metrics, served at /metrics; stage timings are also sent as Server-Timing
+http_request_seconds = metrics.Histogram(
+    "http_request_seconds", "Time to answer a request (until headers for streamed responses).",
+    ["method", "route", "status"])
+upstream_request_seconds = metrics.Histogram(
+    "upstream_request_seconds", "Time until an upstream service answered with headers.", ["upstream", "status"])
+upstream_errors = metrics.Counter(
+    "upstream_errors_total", "Upstream calls that failed or returned an error status.", ["upstream"])
+llm_time_to_first_token = metrics.Histogram(
+    "llm_time_to_first_token_seconds", "Time from sending a prompt to receiving the first token.")
+llm_prompt_eval_seconds = metrics.Histogram(
+    "llm_prompt_eval_seconds", "Prompt evaluation time reported by Ollama (prompt_eval_duration).", ["prefix"])
+llm_tokens_per_second = metrics.Histogram(
+    "llm_tokens_per_second", "Generation speed reported by Ollama (eval_count / eval_duration).",
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300))
+llm_tokens = metrics.Counter("llm_tokens_total", "Tokens evaluated by Ollama.", ["kind"])
+geocode_cascade_depth = metrics.Histogram(
+    "geocode_cascade_depth", "Queries tried before a place was resolved (0 = offline gazetteer).",
+    buckets=(0, 1, 2, 3))
+geocode_results = metrics.Counter("geocode_results_total", "Place lookups by the tier that answered.", ["source"])
+upstream_retries = metrics.Counter("upstream_retries_total", "Upstream calls retried after a failure.", ["upstream"])
+upstream_fallbacks = metrics.Counter(
+    "upstream_fallbacks_total", "Fallback answers served because an upstream's circuit was open.", ["upstream"])
+circuit_breaker_transitions = metrics.Counter(
+    "circuit_breaker_transitions_total", "Circuit breaker state changes.", ["upstream", "state"])
+
+class RateLimiter:
+    """Spaces out calls so that no more than `rate` of them start per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+rate_limiters = {name: RateLimiter(rate) for name, rate in UPSTREAM_RATE_LIMITS.items()}
+
+breakers = {
+    name: CircuitBreaker(
+        name,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_RESET_TIMEOUT,
+        on_change=lambda upstream, state: circuit_breaker_transitions.inc(upstream=upstream, state=state),
+    )
+    for name in ("ollama", "nominatim", "places", "weather")
+}
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-flight call and its result."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = {}
+
+    async def do(self, key, func, *args):
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(func(*args))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller disconnecting does not cancel the shared call
+        return await asyncio.shield(future)
+
+    def running(self, key):
+        return key in self._inflight
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
+
+flights = {
+    "itinerary": SingleFlight(),
+    "batch_itinerary": SingleFlight(),   # batch builds wait on batch_llm_slots, so interactive callers never join them
+    "weather": SingleFlight(),
+    "recommendations": SingleFlight(),
+    "geocode": SingleFlight(),
+    "prefix": SingleFlight(),
+}
+
+# Persistent cache settings
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.sqlite3")
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "100000"))
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 86400)))
+GEOCODE_NEGATIVE_TTL = float(os.getenv("GEOCODE_NEGATIVE_TTL", "3600"))
+
+ITINERARY_CACHE_SIZE = int(os.getenv("ITINERARY_CACHE_SIZE", "5000"))
+ITINERARY_CACHE_TTL = float(os.getenv("ITINERARY_CACHE_TTL", str(7 * 86400)))
+# Preferences falling in the same tiers share a cached itinerary
+ITINERARY_TIME_BUCKET_MINUTES = int(os.getenv("ITINERARY_TIME_BUCKET_MINUTES", "60"))
+ITINERARY_BUDGET_TIERS = [int(tier) for tier in os.getenv("ITINERARY_BUDGET_TIERS", "50,100,250,500,1000,2500").split(",")]
+
+# Generated itineraries kept by id so single stops can be edited later; outlive the itinerary cache
+SAVED_ITINERARY_SIZE = int(os.getenv("SAVED_ITINERARY_SIZE", "20000"))
+SAVED_ITINERARY_TTL = float(os.getenv("SAVED_ITINERARY_TTL", str(ITINERARY_CACHE_TTL)))
+# Upper bound on generated tokens for one replacement stop
+OLLAMA_EDIT_NUM_PREDICT = int(os.getenv("OLLAMA_EDIT_NUM_PREDICT", "256"))
+
+# Itinerary jobs: workers generating at once, jobs allowed to wait, and how long results are kept (seconds)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "60"))
+
+# Batch generation: largest accepted batch, and LLM generations running at once across all batches
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+# Multi-day trips: most days per request, and day generations running at once across all trips
+MULTI_DAY_MAX_DAYS = int(os.getenv("MULTI_DAY_MAX_DAYS", "14"))
+MULTI_DAY_LLM_CONCURRENCY = int(os.getenv("MULTI_DAY_LLM_CONCURRENCY", "8"))
+
+# Weather is served from memory while fresh, and refreshed in the background while stale
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1000"))
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", "3600"))
+# Largest number of distinct cities accepted by /fetch_weather/batch
+WEATHER_BATCH_MAX_CITIES = int(os.getenv("WEATHER_BATCH_MAX_CITIES", "50"))
+
+# Recommendations change rarely; popular cities are refreshed ahead of expiry
+RECOMMENDATIONS_CACHE_SIZE = int(os.getenv("RECOMMENDATIONS_CACHE_SIZE", "5000"))
+RECOMMENDATIONS_CACHE_TTL = float(os.getenv("RECOMMENDATIONS_CACHE_TTL", str(14 * 86400)))
+RECOMMENDATIONS_PREFETCH_INTERVAL = float(os.getenv("RECOMMENDATIONS_PREFETCH_INTERVAL", "3600"))
+RECOMMENDATIONS_PREFETCH_TOP = int(os.getenv("RECOMMENDATIONS_PREFETCH_TOP", "50"))
+RECOMMENDATIONS_REFRESH_AHEAD = float(os.getenv("RECOMMENDATIONS_REFRESH_AHEAD", str(86400)))
+RECOMMENDATIONS_TRACKED_CITIES = int(os.getenv("RECOMMENDATIONS_TRACKED_CITIES", "1000"))
+
+geocode_cache = SQLiteCache(CACHE_DB_PATH, "geocode", GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL)
+itinerary_cache = SQLiteCache(CACHE_DB_PATH, "itineraries", ITINERARY_CACHE_SIZE, ITINERARY_CACHE_TTL)
+saved_itineraries = SQLiteCache(CACHE_DB_PATH, "saved_itineraries", SAVED_ITINERARY_SIZE, SAVED_ITINERARY_TTL)
+weather_cache = MemoryCache(WEATHER_CACHE_SIZE, WEATHER_CACHE_TTL, WEATHER_STALE_TTL)
+recommendations_cache = SQLiteCache(
+    CACHE_DB_PATH, "recommendations", RECOMMENDATIONS_CACHE_SIZE, RECOMMENDATIONS_CACHE_TTL
+)
+
+# How often each city's recommendations were requested, and the spelling to query it by
+# (only cities Places resolved, at most RECOMMENDATIONS_TRACKED_CITIES of them)
+recommendation_requests = Counter()
+recommendation_cities = {}
+# Places statuses whose results may be cached; the others (REQUEST_DENIED, OVER_QUERY_LIMIT, ...) are errors
+PLACES_CACHEABLE_STATUSES = {"OK", "ZERO_RESULTS"}
+
+# Served when Places or OpenWeatherMap cannot be reached
+DEFAULT_RECOMMENDATIONS = ["Local landmarks", "Museums", "Food markets"]
+WEATHER_UNAVAILABLE = {"forecast": "Weather data unavailable", "advice": "Check the local weather."}
+
+batch_llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+multi_day_llm_slots = asyncio.Semaphore(MULTI_DAY_LLM_CONCURRENCY)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-run
+background_tasks = set()
+
+def run_in_background(coro):
+    """Schedules a coroutine without awaiting it."""
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def pool_limits(upstream):
+    """Builds connection pool limits for an upstream from environment settings."""
+    prefix = upstream.upper()
+    return httpx.Limits(
+        max_connections=int(os.getenv(f"{prefix}_MAX_CONNECTIONS", HTTP_MAX_CONNECTIONS)),
+        max_keepalive_connections=int(os.getenv(f"{prefix}_MAX_KEEPALIVE", HTTP_MAX_KEEPALIVE)),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+def upstream_timeout(upstream, read=HTTP_READ_TIMEOUT):
+    """Builds connect and read timeouts for an upstream; waiting for a pooled connection is not limited."""
+    prefix = upstream.upper()
+    read = float(os.getenv(f"{prefix}_READ_TIMEOUT", read))
+    return httpx.Timeout(
+        connect=float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", HTTP_CONNECT_TIMEOUT)),
+        read=read,
+        write=read,
+        pool=None,
+    )
+
+async def call_upstream(upstream, path, **params):
+    """GETs `path` from an upstream, honouring its rate limit, retries and circuit breaker.
+
+    Raises CircuitOpen without calling out while the upstream's breaker is open.
+    """
+    async def attempt():
+        await rate_limiters[upstream].acquire()
+        response = await http_clients[upstream].get(path, params=params)
+        response.raise_for_status()
+        return response
+
+    return await call_with_retries(
+        attempt,
+        breakers[upstream],
+        retries=int(os.getenv(f"{upstream.upper()}_RETRIES", UPSTREAM_RETRIES)),
+        backoff=UPSTREAM_RETRY_BACKOFF,
+        max_backoff=UPSTREAM_RETRY_MAX_BACKOFF,
+        on_retry=lambda error: upstream_retries.inc(upstream=upstream),
+    )
+
+def upstream_hooks(upstream):
+    """httpx event hooks that time each upstream call until its response headers arrive."""
+    async def on_request(request):
+        request.extensions["started_at"] = time.perf_counter()
+
+    async def on_response(response):
+        elapsed = time.perf_counter() - response.request.extensions["started_at"]
+        upstream_request_seconds.observe(elapsed, upstream=upstream, status=response.status_code)
+        metrics.add_server_timing(f"{upstream}_api", elapsed)
+
+    return {"request": [on_request], "response": [on_response]}
+
+@app.on_event("startup")
+async def open_http_clients():
+    """Creates one keep-alive connection pool per upstream service."""
+    for name, settings in UPSTREAMS.items():
+        http_clients[name] = httpx.AsyncClient(
+            base_url=settings["base_url"],
+            headers=settings.get("headers"),
+            limits=pool_limits(name),
+            timeout=upstream_timeout(name),
+            event_hooks=upstream_hooks(name),
+        )
+    ollama_pool.start(lambda url: httpx.AsyncClient(
+        base_url=url,
+        limits=pool_limits("ollama"),
+        timeout=upstream_timeout("ollama", read=OLLAMA_READ_TIMEOUT),
+        event_hooks=upstream_hooks("ollama"),
+    ))
+
+@app.on_event("startup")
+async def warm_up_model():
+    """Starts loading the model in the background so the first itinerary skips the load time."""
+    if OLLAMA_WARM_UP:
+        run_in_background(load_model())
+
+async def load_model():
+    """Asks every Ollama server to load the model and keep it resident for OLLAMA_KEEP_ALIVE."""
+    async def load(backend):
+        started = time.perf_counter()
+        try:
+            # Loading a large model from disk can take minutes; this runs in the background
+            response = await backend.client.post(
+                "/api/generate", json={"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE}, timeout=None
+            )
+            response.raise_for_status()
+            print(f"Loaded {OLLAMA_MODEL} on {backend.url} in {time.perf_counter() - started:.1f}s")
+        except httpx.HTTPError as e:
+            upstream_errors.inc(upstream="ollama")
+            print(f"Could not warm up {OLLAMA_MODEL} on {backend.url}: {e}")
+
+    await asyncio.gather(*(load(backend) for backend in ollama_pool.backends))
+
+@app.on_event("startup")
+async def start_preference_writer():
+    """Creates the User.id constraint and starts flushing queued preference writes."""
+    try:
+        await run_in_threadpool(create_user_constraint)
+    except Exception as e:
+        print(f"Could not create User.id constraint: {e}")
+    preference_writer.start()
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Starts the itinerary job worker pool."""
+    itinerary_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    """Stops the itinerary job workers, cancelling jobs still running."""
+    await itinerary_jobs.close()
+
+@app.on_event("shutdown")
+async def flush_preference_writer():
+    """Writes out any preferences still queued."""
+    await preference_writer.close()
+
+@app.on_event("startup")
+async def start_prefetcher():
+    """Starts the background refresh of popular cities' recommendations."""
+    run_in_background(prefetch_recommendations())
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    """Cancels prefetching and background refreshes."""
+    for task in list(background_tasks):
+        task.cancel()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Closes the upstream connection pools."""
+    for client in http_clients.values():
+        await client.aclose()
+    http_clients.clear()
+    await ollama_pool.close()
 
 class UserPreference(BaseModel):
     user_id: str
@@ -102,9 +505,60 @@ class UserPreference(BaseModel):
     budget: int
     starting_point: str = None
 
-def generate_text(prompt):
-    """Generates response from LLM model with structured schema for itinerary details."""
-    schema = """
+class WeatherBatchRequest(BaseModel):
+    cities: list[str]
+
+class ItineraryBatchRequest(BaseModel):
+    preferences: list[UserPreference]
+
+class ItineraryDay(BaseModel):
+    date: str = None
+    start_time: str = None   # defaults to the preferences' times
+    end_time: str = None
+
+class MultiDayItineraryRequest(BaseModel):
+    preferences: UserPreference
+    days: list[ItineraryDay]
+    exclude: list[str] = None     # places the traveller has already seen
+
+class ItineraryStop(BaseModel):
+    name: str
+    address: str = None
+    start_time: str = None
+    end_time: str = None
+    activity: str = None
+    travel_method: str = None
+    travel_time: str = None
+    cost: str = None
+    notes: str = None
+
+class ItineraryOutput(BaseModel):
+    stops: list[ItineraryStop]
+    total_cost: str = None
+
+class MapDataEntry(BaseModel):
+    place: str
+    coordinates: tuple[float, float]
+
+    class Config:
+        extra = "allow"   # routing fields such as scheduled_start are kept as sent
+
+class EditableItinerary(BaseModel):
+    """The parts of an itinerary response that a stop edit reads."""
+    stops: list[ItineraryStop]
+    map_data: list[MapDataEntry] = []
+    route: dict = None
+    geocoding: list = None
+
+class StopEditRequest(BaseModel):
+    stop_index: int
+    instruction: str
+    itinerary_id: str = None
+    # Without an id: a previous itinerary response (with full map_data) and the preferences it was made for
+    itinerary: dict = None
+    preferences: UserPreference = None
+
+ITINERARY_SCHEMA = """
     Please provide the itinerary in the following structured format. Each stop should include a location name and any necessary address or details for accurate mapping. 
 
     Format:
@@ -131,119 +585,483 @@ def generate_text(prompt):
     Include a final line with "Total Estimated Cost: [Total cost for the day]" if applicable.
     """
 
-    full_prompt = prompt + "\n\n" + schema
-    try:
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": OLLAMA_MODEL, "prompt": full_prompt},
-            stream=True
-        )
+# The closing line ITINERARY_SCHEMA asks for (render_itinerary writes the same line)
+TOTAL_COST_PATTERN = re.compile(r"^\s*Total Estimated Cost:\s*(.+)$", re.MULTILINE)
+
+# JSON schema passed as Ollama's `format`, so the output can be validated into ItineraryOutput
+STOP_JSON_FIELDS = ["name", "address", "start_time", "end_time", "activity",
+                    "travel_method", "travel_time", "cost", "notes"]
+ITINERARY_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "stops": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {field: {"type": "string"} for field in STOP_JSON_FIELDS},
+                "required": STOP_JSON_FIELDS[:-1],
+            },
+        },
+        "total_cost": {"type": "string"},
+    },
+    "required": ["stops"],
+}
+
+ITINERARY_JSON_INSTRUCTIONS = """
+    Respond only with JSON matching the provided schema. List the stops in visiting order.
+    For each stop give the name with the city (e.g. "Eiffel Tower, Paris"), the full address,
+    start and end times like "9:00 AM", a short activity, the travel method and travel time
+    from the previous stop, the cost in local currency, and optional notes.
+    """
+
+# Ollama context for each evaluated instruction prefix, keyed by prefix_key
+prefix_contexts = {}
+# When a prefix whose evaluation failed may be tried again, so failures do not add a call per request
+prefix_retry_at = {}
+PREFIX_RETRY_SECONDS = 60
+# Prompt evaluation totals for generations with and without a cached prefix
+prompt_eval_totals = {"cached": Counter(), "none": Counter()}
+
+PREFIX_ACKNOWLEDGEMENT = "\n\nReply with OK. The trip details follow in the next message."
+
+def prefix_key(instructions, json_schema=None):
+    """Identifies a prefix by model and exact text, so changing either evaluates it afresh."""
+    material = json.dumps([OLLAMA_MODEL, instructions, json_schema], sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:16]
+
+async def prefix_context(instructions, json_schema=None):
+    """Returns (key, context) for the instructions, evaluating them once; context is None on failure."""
+    key = prefix_key(instructions, json_schema)
+    entry = prefix_contexts.get(key)
+    if entry is None:
+        if time.monotonic() < prefix_retry_at.get(key, 0):
+            return key, None
+        try:
+            entry = await flights["prefix"].do(key, evaluate_prefix, key, instructions)
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            upstream_errors.inc(upstream="ollama")
+            prefix_retry_at[key] = time.monotonic() + PREFIX_RETRY_SECONDS
+            print(f"Could not evaluate the prompt prefix, sending it in full: {e!r}")
+            return key, None
+    return key, entry["context"]
+
+async def evaluate_prefix(key, instructions):
+    """Has Ollama evaluate the instructions on their own and keeps the context it returns."""
+    with metrics.timed("llm_prefix"):
+        response = await ollama_pool.request("POST", "/api/generate", json={
+            "model": OLLAMA_MODEL,
+            "prompt": instructions + PREFIX_ACKNOWLEDGEMENT,
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"num_predict": 1},
+        })
         response.raise_for_status()
+        data = response.json()
+    entry = {
+        "model": OLLAMA_MODEL,
+        "context": data["context"],
+        "prompt_eval_count": data.get("prompt_eval_count"),
+        "prompt_eval_ms": round(data.get("prompt_eval_duration", 0) / 1e6, 1),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    prefix_contexts[key] = entry
+    print(f"Cached prompt prefix {key}: {entry['prompt_eval_count']} tokens in {entry['prompt_eval_ms']} ms")
+    return entry
+
+async def stream_text(prompt, json_schema=None, num_predict=None):
+    """Yields response chunks from the LLM as Ollama streams them.
+
+    With `json_schema`, Ollama is constrained to JSON matching it instead of the text format.
+    When prefix caching is on, the format instructions are not resent: the request carries
+    the context Ollama returned after evaluating them once. Each request goes to the
+    least-loaded healthy server in ollama_pool. `num_predict` overrides OLLAMA_NUM_PREDICT.
+    """
+    instructions = ITINERARY_JSON_INSTRUCTIONS if json_schema else ITINERARY_SCHEMA
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt + "\n\n" + instructions,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {"num_predict": num_predict or OLLAMA_NUM_PREDICT},
+    }
+    if json_schema:
+        payload["format"] = json_schema
+    started = time.perf_counter()
+    breakers["ollama"].check()
+    key, context = None, None
+    first_token = True
+    try:
+        # Inside the try so a cancellation while the prefix is evaluated still frees a half-open trial slot
+        if OLLAMA_PREFIX_CACHE:
+            key, context = await prefix_context(instructions, json_schema)
+        if context:
+            payload["prompt"] = prompt
+            payload["context"] = context
+        with metrics.timed("llm"):
+            async with aclosing(ollama_pool.stream_lines("/api/generate", payload, OLLAMA_HEDGE_AFTER)) as lines:
+                async for line in lines:
+                    if line:
+                        data = json.loads(line)
+                        if data.get("response"):
+                            if first_token:
+                                first_token = False
+                                elapsed = time.perf_counter() - started
+                                llm_time_to_first_token.observe(elapsed)
+                                metrics.add_server_timing("llm_ttft", elapsed)
+                            yield data["response"]
+                        if data.get("done", False):
+                            record_generation_stats(data, "cached" if context else "none")
+                            break
+    except (httpx.HTTPError, json.JSONDecodeError):
+        breakers["ollama"].failure()
+        upstream_errors.inc(upstream="ollama")
+        if context:
+            # The stored context may no longer suit the model; evaluate the prefix again next time
+            prefix_contexts.pop(key, None)
+        raise
+    except BaseException:
+        breakers["ollama"].abandon()  # the caller stopped reading or was cancelled
+        raise
+    else:
+        breakers["ollama"].success()
+
+def record_generation_stats(data, prefix="none"):
+    """Records token counts and speeds from the final message of an Ollama stream."""
+    if data.get("prompt_eval_duration"):
+        llm_prompt_eval_seconds.observe(data["prompt_eval_duration"] / 1e9, prefix=prefix)
+        totals = prompt_eval_totals[prefix]
+        totals["requests"] += 1
+        totals["tokens"] += data.get("prompt_eval_count", 0)
+        totals["seconds"] += data["prompt_eval_duration"] / 1e9
+    llm_tokens.inc(data.get("prompt_eval_count", 0), kind="prompt")
+    llm_tokens.inc(data.get("eval_count", 0), kind="generated")
+    if data.get("eval_count") and data.get("eval_duration"):
+        llm_tokens_per_second.observe(data["eval_count"] / (data["eval_duration"] / 1e9))
+
+async def generate_text(prompt, json_schema=None, num_predict=None):
+    """Generates response from LLM model with structured schema for itinerary details."""
+    try:
         full_response = ""
-        for line in response.iter_lines():
-            if line:
-                line_data = line.decode('utf-8')
-                data = json.loads(line_data)
-                full_response += data.get("response", "")
-                if data.get("done", False):
-                    break
+        async for chunk in stream_text(prompt, json_schema, num_predict):
+            full_response += chunk
         return full_response if full_response else "Error: No response generated."
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"Request failed: {e}"
     except json.JSONDecodeError as e:
         return f"JSON parsing error: {e}"
 
-def store_user_memory(user_id, preferences):
-    """Stores user preferences in Neo4j for continuity across sessions."""
+def store_user_memories(rows):
+    """Stores a batch of preference rows in Neo4j with a single UNWIND MERGE."""
+    try:
+        with metrics.timed("neo4j_write"), neo4j_driver.session() as session:
+            session.run("""
+                UNWIND $rows AS row
+                MERGE (u:User {id: row.user_id})
+                SET u.city = row.city,
+                    u.start_time = row.start_time,
+                    u.end_time = row.end_time,
+                    u.interests = row.interests,
+                    u.budget = row.budget,
+                    u.starting_point = row.starting_point
+                """, rows=rows)
+    except Exception:
+        upstream_errors.inc(upstream="neo4j")
+        raise
+
+def preference_row(user_id, preferences):
+    """Flattens preferences into the property row written for a User node."""
+    return {
+        "user_id": user_id,
+        "city": preferences.get('city'),
+        "start_time": preferences.get('start_time'),
+        "end_time": preferences.get('end_time'),
+        "interests": ', '.join(preferences['interests']) if preferences.get('interests') else "",
+        "budget": preferences.get('budget'),
+        "starting_point": preferences.get('starting_point'),
+    }
+
+def create_user_constraint():
+    """Ensures User.id is unique, which also gives MERGE an index to look users up by."""
     with neo4j_driver.session() as session:
-        interests_str = ', '.join(preferences['interests']) if preferences.get('interests') else ""
-        session.run("""
-            MERGE (u:User {id: $user_id})
-            SET u.city = $city,
-                u.start_time = $start_time,
-                u.end_time = $end_time,
-                u.interests = $interests,
-                u.budget = $budget,
-                u.starting_point = $starting_point
-            """, user_id=user_id, city=preferences.get('city'), start_time=preferences.get('start_time'),
-            end_time=preferences.get('end_time'), interests=interests_str,
-            budget=preferences.get('budget'), starting_point=preferences.get('starting_point'))
-
-def get_recommendations_based_on_city(city):
+        session.run("CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE")
+
+preference_writer = WriteBehindQueue(
+    store_user_memories,
+    max_batch=PREFERENCE_BATCH_SIZE,
+    flush_interval=PREFERENCE_FLUSH_INTERVAL,
+    max_pending=PREFERENCE_QUEUE_SIZE,
+    key=lambda row: row["user_id"],
+)
+
+async def get_recommendations_based_on_city(city):
+    """Fetch popular places in a city from cache, or from Places shared with concurrent requests."""
+    with metrics.timed("recommendations"):
+        key = normalize_key(city)
+        recommendations = recommendations_cache.get(key)
+        if recommendations is MISSING:
+            recommendations = await flights["recommendations"].do(key, fetch_recommendations, city)
+        if recommendations and recommendations != DEFAULT_RECOMMENDATIONS:
+            track_recommendation_request(key, city)
+        return recommendations
+
+def track_recommendation_request(key, city):
+    """Counts a request for a resolved city, forgetting the least-requested other city when full."""
+    if key not in recommendation_requests and len(recommendation_requests) >= RECOMMENDATIONS_TRACKED_CITIES:
+        evicted = min(recommendation_requests, key=recommendation_requests.get)
+        del recommendation_requests[evicted]
+        recommendation_cities.pop(evicted, None)
+    recommendation_requests[key] += 1
+    recommendation_cities.setdefault(key, city)
+
+async def prefetch_recommendations():
+    """Periodically refreshes the most requested cities before their cached entries expire."""
+    while True:
+        await asyncio.sleep(RECOMMENDATIONS_PREFETCH_INTERVAL)
+        for key, _ in recommendation_requests.most_common(RECOMMENDATIONS_PREFETCH_TOP):
+            remaining = recommendations_cache.expires_in(key)
+            if remaining is not None and remaining > RECOMMENDATIONS_REFRESH_AHEAD:
+                continue
+            try:
+                await flights["recommendations"].do(key, fetch_recommendations, recommendation_cities[key])
+            except Exception as e:
+                print(f"Error prefetching recommendations for {key}: {e}")
+
+async def fetch_recommendations(city):
     """Fetch popular places in a city using Google Places API."""
-    url = f"https://maps.googleapis.com/maps/api/place/textsearch/json?query=popular+places+in+{city}&key={GOOGLE_PLACES_API_KEY}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        response = await call_upstream(
+            "places", "/maps/api/place/textsearch/json",
+            query=f"popular places in {city}", key=GOOGLE_PLACES_API_KEY
+        )
         data = response.json()
-        return [place["name"] for place in data["results"][:5]]
-    except requests.RequestException as e:
+        if data.get("status") not in PLACES_CACHEABLE_STATUSES:
+            # REQUEST_DENIED, OVER_QUERY_LIMIT, ... arrive as HTTP 200 with no results: serve defaults, cache nothing
+            upstream_errors.inc(upstream="places")
+            print(f"Places API returned {data.get('status')} for {city}: {data.get('error_message', '')}")
+            return list(DEFAULT_RECOMMENDATIONS)
+        recommendations = [place["name"] for place in data["results"][:5]]
+        recommendations_cache.set(normalize_key(city), recommendations)
+        return recommendations
+    except CircuitOpen:
+        upstream_fallbacks.inc(upstream="places")
+        return list(DEFAULT_RECOMMENDATIONS)
+    except httpx.HTTPError as e:
+        upstream_errors.inc(upstream="places")
         print(f"Error fetching recommendations for {city}: {e}")
-        return ["Local landmarks", "Museums", "Food markets"]
+        return list(DEFAULT_RECOMMENDATIONS)
 
 @app.get("/fetch_weather/{city}")
 async def fetch_weather(city: str):
+    """Fetch weather data for the city, served from cache when possible."""
+    return await get_weather(city)
+
+@app.post("/fetch_weather/batch")
+async def fetch_weather_batch(request: WeatherBatchRequest):
+    """Fetch weather for several cities in one response, looking up cache misses concurrently."""
+    cities = list(dict.fromkeys(request.cities))
+    if len(cities) > WEATHER_BATCH_MAX_CITIES:
+        raise HTTPException(status_code=413, detail=f"A batch can hold at most {WEATHER_BATCH_MAX_CITIES} cities.")
+    forecasts = await asyncio.gather(*(get_weather(city) for city in cities))
+    return {"weather": dict(zip(cities, forecasts))}
+
+async def get_weather(city):
+    """Returns cached weather, refreshing stale entries in the background."""
+    with metrics.timed("weather"):
+        key = normalize_key(city)
+        weather, state = weather_cache.get(key)
+        if state == "stale":
+            run_in_background(flights["weather"].do(key, lookup_weather, city))
+        if state != "miss":
+            return weather
+        return await flights["weather"].do(key, lookup_weather, city)
+
+async def lookup_weather(city):
     """Fetch weather data for the city using OpenWeatherMap API."""
-    url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        response = await call_upstream(
+            "weather", "/data/2.5/weather", q=city, appid=OPENWEATHER_API_KEY, units="metric"
+        )
         data = response.json()
         weather_info = {
             "forecast": data["weather"][0]["description"].capitalize(),
             "temperature": f"{data['main']['temp']} °C",
             "advice": "Ideal for outdoor activities." if data["main"]["temp"] > 15 else "Consider wearing a jacket."
         }
+        weather_cache.set(normalize_key(city), weather_info)
         return weather_info
-    except requests.RequestException as e:
+    except CircuitOpen:
+        upstream_fallbacks.inc(upstream="weather")
+        return dict(WEATHER_UNAVAILABLE)
+    except httpx.HTTPError as e:
+        upstream_errors.inc(upstream="weather")
         print(f"Error fetching weather for {city}: {e}")
-        return {"forecast": "Weather data unavailable", "advice": "Check the local weather."}
+        return dict(WEATHER_UNAVAILABLE)
+
+async def get_coordinates(place_name, city, address=None):
+    """Fetch coordinates for a place, sharing the lookup with concurrent identical requests."""
+    key = tuple(normalize_key(part or "") for part in (place_name, city, address))
+    with metrics.timed("geocode"):
+        return await flights["geocode"].do(key, lookup_coordinates, place_name, city, address)
+
+async def lookup_coordinates(place_name, city, address=None):
+    """Fetch coordinates for a given place, from the offline gazetteer or Nominatim with a retry mechanism."""
+    if gazetteer:
+        coordinates = gazetteer.lookup(place_name, city)
+        if coordinates:
+            return geocoded(coordinates, "gazetteer", 0)
 
-def get_coordinates(place_name, city, address=None):
-    """Fetch coordinates for a given place using Nominatim API with a retry mechanism."""
     query_attempts = [
         address,                  # Most specific: full address
         f"{place_name}, {city}",  # Fallback: place name + city
         city                      # Least specific: city only
     ]
     
+    depth = 0
+    nominatim_down = False
     for query in query_attempts:
         if not query:  # Skip if query is None
             continue
-        
+        depth += 1
+
+        if query == city and gazetteer:
+            center = gazetteer.city(city)
+            if center:
+                return geocoded(center, "gazetteer_city", depth)
+
+        cache_key = normalize_key(query)
+        cached = geocode_cache.get(cache_key)
+        if cached is not MISSING:
+            if cached:
+                return geocoded(tuple(cached), "cache", depth)
+            continue  # Recently confirmed to have no result
+        if nominatim_down:
+            continue  # Only cached answers and the city centre are left to try
+
         try:
-            response = requests.get(
-                "https://nominatim.openstreetmap.org/search",
-                params={"q": query, "format": "json", "limit": 1},
-                headers={"User-Agent": "tour-planning-app"}
-            )
-            response.raise_for_status()
+            response = await call_upstream("nominatim", "/search", q=query, format="json", limit=1)
             data = response.json()
             
             if data:  # If valid coordinates are found, return them
                 print(f"Coordinates found for '{query}': ({data[0]['lat']}, {data[0]['lon']})")
-                return float(data[0]["lat"]), float(data[0]["lon"])
+                coordinates = float(data[0]["lat"]), float(data[0]["lon"])
+                geocode_cache.set(cache_key, coordinates)
+                return geocoded(coordinates, "nominatim", depth)
             else:
                 print(f"Warning: No coordinates found for query '{query}'.")
+                geocode_cache.set(cache_key, None, ttl=GEOCODE_NEGATIVE_TTL)
 
-        except requests.RequestException as e:
+        except CircuitOpen:
+            nominatim_down = True
+            upstream_fallbacks.inc(upstream="nominatim")
+        except httpx.HTTPError as e:
+            upstream_errors.inc(upstream="nominatim")
             print(f"Error fetching coordinates for query '{query}': {e}")
     
     # If all attempts fail, return a placeholder indicating failure
     print("All attempts failed to fetch coordinates.")
+    geocode_results.inc(source="failed")
     return (None, None)
 
+def geocoded(coordinates, source, depth):
+    """Records which tier of the geocoding cascade answered, and how deep it had to go."""
+    geocode_results.inc(source=source)
+    geocode_cascade_depth.observe(depth)
+    return coordinates
+
+@app.middleware("http")
+async def record_request_timing(request, call_next):
+    """Times each request and reports its stages in a Server-Timing header."""
+    timings = []
+    token = metrics.request_timings.set(timings)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.request_timings.reset(token)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    http_request_seconds.observe(
+        elapsed, method=request.method, route=route.path if route else "unmatched", status=response.status_code
+    )
+    response.headers["Server-Timing"] = metrics.server_timing_header(timings + [("total", elapsed)])
+    return response
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Expose latency histograms and counters in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Report hit/miss counters and sizes of the persistent caches."""
+    return {
+        "geocode": geocode_cache.stats(),
+        "itineraries": itinerary_cache.stats(),
+        "weather": weather_cache.stats(),
+        "recommendations": recommendations_cache.stats()
+    }
+
+@app.get("/preference_write_stats")
+async def preference_write_stats():
+    """Report queue depth and throughput of the batched Neo4j preference writer."""
+    return preference_writer.stats()
+
+@app.get("/prompt_cache_stats")
+async def prompt_cache_stats():
+    """Report cached prompt prefixes and prompt evaluation time with and without them."""
+    def averages(totals):
+        requests = totals["requests"]
+        return {
+            "requests": requests,
+            "avg_prompt_eval_ms": round(totals["seconds"] / requests * 1000, 1) if requests else None,
+            "avg_prompt_tokens": round(totals["tokens"] / requests, 1) if requests else None,
+        }
+
+    return {
+        "enabled": OLLAMA_PREFIX_CACHE,
+        "prefixes": {
+            key: {
+                "model": entry["model"],
+                "prompt_eval_count": entry["prompt_eval_count"],
+                "prompt_eval_ms": entry["prompt_eval_ms"],
+                "context_tokens": len(entry["context"]),
+                "created_at": entry["created_at"],
+            }
+            for key, entry in prefix_contexts.items()
+        },
+        "without_prefix": averages(prompt_eval_totals["none"]),
+        "with_prefix": averages(prompt_eval_totals["cached"]),
+    }
+
+@app.get("/llm_backends")
+async def llm_backends():
+    """Report load, health and hedging for each Ollama server in the pool."""
+    return {"hedge_after_s": OLLAMA_HEDGE_AFTER or None, **ollama_pool.stats()}
+
+@app.get("/circuit_breakers")
+async def circuit_breakers():
+    """Report each upstream's circuit breaker state, failures and refused calls."""
+    return {name: breaker.stats() for name, breaker in breakers.items()}
+
+@app.get("/coalescing_stats")
+async def coalescing_stats():
+    """Report how many upstream calls were made and how many requests shared one."""
+    return {name: flight.stats() for name, flight in flights.items()}
+
 @app.post("/collect_preferences/")
 async def collect_preferences(preferences: UserPreference):
     """Collect user preferences and store them in Neo4j."""
     preference_data = preferences.dict()
     try:
-        store_user_memory(preferences.user_id, preference_data)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error storing preferences: {e}")
+        await preference_writer.put(
+            preference_row(preferences.user_id, preference_data), timeout=PREFERENCE_ENQUEUE_TIMEOUT
+        )
+    except QueueFull as e:
+        raise HTTPException(
+            status_code=503, detail=f"Preference store is busy: {e}", headers={"Retry-After": "1"}
+        )
 
     if not preferences.interests:
-        recommendations = get_recommendations_based_on_city(preferences.city)
+        recommendations = await get_recommendations_based_on_city(preferences.city)
         return {
             "status": "Preferences collected successfully",
             "recommendations": recommendations
@@ -251,65 +1069,766 @@ async def collect_preferences(preferences: UserPreference):
     return {"status": "Preferences collected successfully"}
 
 @app.post("/generate_itinerary/")
-async def generate_itinerary(preferences: UserPreference):
+async def generate_itinerary(preferences: UserPreference, bypass_cache: bool = False, map_format: str = "full"):
     """Generate a detailed itinerary with structured stops and map data."""
-    prompt = (
-        f"Create a detailed itinerary for {preferences.city} that includes activities related "
-        f"to {preferences.interests}, starting from {preferences.starting_point or 'a central location'} "
-        f"at {preferences.start_time} and ending by {preferences.end_time}. "
-        f"Budget is approximately {preferences.budget}. Format the response as per the provided schema."
-    )
-    
-    response = generate_text(prompt)
-    print("Debug - Raw LLM Response:", response)
+    check_map_format(map_format)
+    cache_key = itinerary_cache_key(preferences)
+    if not bypass_cache:
+        cached = itinerary_cache.get(cache_key)
+        if cached is not MISSING:
+            return shape_map_data({**cached, "cached": True}, map_format)
+
+    result = await flights["itinerary"].do(cache_key, build_itinerary, preferences, cache_key)
+    return shape_map_data({**result, "cached": False}, map_format)
+
+def check_map_format(map_format):
+    if map_format not in MAP_FORMATS:
+        raise HTTPException(status_code=400, detail=f"map_format must be one of {', '.join(MAP_FORMATS)}")
+
+def shape_map_data(result, map_format):
+    """Returns the result with map_data as full entries or as a compact GeoJSON FeatureCollection."""
+    if map_format == "compact":
+        return {**result, "map_data": to_feature_collection(result["map_data"], MAP_COORDINATE_PRECISION)}
+    return result
+
+async def build_itinerary(preferences, cache_key, llm_slots=None, geocode=None):
+    """Generates, parses and geocodes an itinerary, then stores it in the itinerary cache.
 
-    stops = extract_stops_from_response(response)
+    `llm_slots` (a semaphore) bounds concurrent generations; it is released before geocoding.
+    `geocode` replaces get_coordinates, e.g. to share lookups across a batch.
+    """
+    prompt = build_itinerary_prompt(preferences)
+    async with llm_slots or nullcontext():
+        if ITINERARY_FORMAT == "json":
+            response, stops = await generate_structured_itinerary(prompt)
+        else:
+            response = await generate_text(prompt)
+            print("Debug - Raw LLM Response:", response)
+            stops = extract_stops_from_response(response)
     print("Debug - Extracted Stops:", stops)
 
+    geocoded = await geocode_stops(stops, preferences.city, geocode)
+    map_data, geocoding = collect_map_data(stops, geocoded)
+
+    with metrics.timed("route"):
+        map_data, route = plan_route(map_data, preferences.start_time, preferences.end_time)
+    itinerary, stops, geocoding = follow_route(response, stops, geocoding, map_data, route)
+    result = {"itinerary": itinerary, "stops": stops, "map_data": map_data, "route": route, "geocoding": geocoding}
+    if stops:
+        result["itinerary_id"] = save_itinerary(preferences, result)
+        itinerary_cache.set(cache_key, result)
+    return result
+
+def collect_map_data(stops, geocoded):
+    """Pairs stops with their (coordinates, seconds) lookups; returns map_data and the geocoding report."""
     map_data = []
-    for stop in stops:
-        coordinates = get_coordinates(stop["name"], preferences.city, stop.get("address"))
-        
+    geocoding = []
+    for stop, (coordinates, elapsed) in zip(stops, geocoded):
+        geocoding.append({
+            "place": stop["name"],
+            "found": coordinates != (None, None),
+            "elapsed_ms": round(elapsed * 1000, 1)
+        })
+
         # Only include stops with valid coordinates
         if coordinates != (None, None):
-            map_data.append({
-                "place": stop["name"],
-                "coordinates": coordinates,
-                "address": stop["address"],
-                "start_time": stop["start_time"],
-                "end_time": stop["end_time"],
-                "activity": stop["activity"],
-                "travel_method": stop["travel_method"],
-                "cost": stop["cost"]
-            })
+            map_data.append(map_entry(stop, coordinates))
         else:
             print(f"Skipping stop '{stop['name']}' due to failed geocoding.")
+    return map_data, geocoding
 
-    itinerary = format_itinerary(response)
-    return {"itinerary": itinerary, "map_data": map_data}
+def follow_route(response, stops, geocoding, routed, route):
+    """Puts the stops in the order plan_route chose; returns (itinerary text, stops, geocoding).
 
-def extract_stops_from_response(response_text):
-    """Extracts stops with detailed location info from the LLM-generated response text."""
-    stop_pattern = re.compile(
-        r"\d+\.\s*Stop Name:\s*(.+?)\n\s*- Address:\s*(.+?)\n\s*- Time:\s*(\d{1,2}:\d{2} [AP]M)\s*-\s*(\d{1,2}:\d{2} [AP]M)\n\s*- Activity:\s*(.+?)\n\s*- Travel Method:\s*(.+?)\n\s*- Travel Time:\s*(\d+ minutes)\n\s*- Cost:\s*([^\n]*)",
-        re.DOTALL
+    If the route was reordered, the geocoded stops take the route's order and
+    schedule (stops that could not be geocoded keep their place) and the text
+    is rendered again from the stops. Otherwise the LLM's text and order stand.
+    """
+    if not route or not route["reordered"]:
+        return format_itinerary(response), stops, geocoding
+    slots = [position for position, report in enumerate(geocoding) if report["found"]]
+    ordered_stops, ordered_geocoding = list(stops), list(geocoding)
+    for position, (slot, index, entry) in enumerate(zip(slots, route["order"], routed)):
+        original = slots[index]
+        stop = {**stops[original], "start_time": entry["scheduled_start"], "end_time": entry["scheduled_end"]}
+        if position:
+            # The first stop's travel time is from the starting point, which the route does not measure
+            stop["travel_time"] = f"{entry['computed_travel_minutes']} minutes"
+        ordered_stops[slot] = stop
+        ordered_geocoding[slot] = geocoding[original]
+    return render_stops(ordered_stops, total_cost(response)), ordered_stops, ordered_geocoding
+
+def save_itinerary(preferences, result):
+    """Keeps an itinerary and the preferences behind it so its stops can be edited later; returns its id."""
+    itinerary_id = uuid.uuid4().hex
+    saved_itineraries.set(itinerary_id, {
+        "preferences": preferences.dict(exclude_none=True),
+        "result": {field: result.get(field) for field in ("itinerary", "stops", "map_data", "route", "geocoding")},
+    })
+    return itinerary_id
+
+def itinerary_cache_key(preferences):
+    """Builds a canonical cache key so equivalent preferences share an itinerary."""
+    canonical = {
+        "city": normalize_key(preferences.city),
+        "interests": sorted(normalize_key(interest) for interest in preferences.interests),
+        "start": time_bucket(preferences.start_time),
+        "end": time_bucket(preferences.end_time),
+        "budget": bisect.bisect_left(ITINERARY_BUDGET_TIERS, preferences.budget),
+        "starting_point": normalize_key(preferences.starting_point or ""),
+    }
+    return json.dumps(canonical, sort_keys=True)
+
+def time_bucket(value):
+    """Rounds a time like '9:20 AM' down to the configured bucket, in minutes after midnight."""
+    minutes = parse_clock(value)
+    if minutes is None:
+        return normalize_key(value)
+    return minutes - minutes % ITINERARY_TIME_BUCKET_MINUTES
+
+@app.post("/plan_tour/")
+async def plan_tour(preferences: UserPreference, bypass_cache: bool = False, map_format: str = "full"):
+    """Store preferences, fetch weather and generate the itinerary concurrently in one request."""
+    check_map_format(map_format)
+    collected, itinerary, weather = await asyncio.gather(
+        collect_preferences(preferences),
+        generate_itinerary(preferences, bypass_cache, map_format),
+        get_weather(preferences.city)
     )
-    
-    stops = []
-    for match in stop_pattern.finditer(response_text):
-        stop = {
-            "name": match.group(1),
-            "address": match.group(2),
-            "start_time": match.group(3),
-            "end_time": match.group(4),
-            "activity": match.group(5),
-            "travel_method": match.group(6),
-            "travel_time": match.group(7),
-            "cost": match.group(8)
+    return {
+        **itinerary,
+        "status": collected["status"],
+        "recommendations": collected.get("recommendations"),
+        "weather": weather
+    }
+
+@app.post("/generate_itinerary/batch")
+async def generate_itinerary_batch(request: ItineraryBatchRequest, bypass_cache: bool = False, map_format: str = "full"):
+    """Generate many itineraries, streaming each one as NDJSON as soon as it is ready."""
+    check_map_format(map_format)
+    if len(request.preferences) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch can hold at most {BATCH_MAX_ITEMS} itineraries.")
+    return StreamingResponse(
+        batch_events(request.preferences, bypass_cache, map_format),
+        media_type="application/x-ndjson"
+    )
+
+class BatchGeocoder:
+    """Shares place lookups across a batch: each place is geocoded once per city, whatever address the LLM gave."""
+
+    def __init__(self):
+        self.requested = 0
+        self._lookups = {}
+
+    async def get(self, place_name, city, address=None):
+        self.requested += 1
+        key = (normalize_key(place_name), normalize_key(city))
+        task = self._lookups.get(key)
+        if task is None:
+            task = self._lookups[key] = asyncio.ensure_future(get_coordinates(place_name, city, address))
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"requested": self.requested, "unique": len(self._lookups)}
+
+async def batch_events(items, bypass_cache=False, map_format="full"):
+    """Yields an item (or error) event per itinerary in completion order, then a summary event."""
+    started = time.perf_counter()
+    geocoder = BatchGeocoder()
+
+    async def run(index, preferences):
+        item_started = time.perf_counter()
+        try:
+            cache_key = itinerary_cache_key(preferences)
+            cached = MISSING if bypass_cache else itinerary_cache.get(cache_key)
+            if cached is not MISSING:
+                result = {**cached, "cached": True}
+            elif flights["itinerary"].running(cache_key):
+                # An interactive build holds no batch slot, so joining it never waits behind the batch cap
+                result = {**await flights["itinerary"].do(cache_key, build_itinerary, preferences, cache_key), "cached": False}
+            else:
+                result = await flights["batch_itinerary"].do(
+                    cache_key, build_itinerary, preferences, cache_key, batch_llm_slots, geocoder.get
+                )
+                result = {**result, "cached": False}
+        except Exception as e:
+            print(f"Batch item {index} failed: {e!r}")
+            return {"type": "error", "index": index, "user_id": preferences.user_id, "detail": str(e)}
+        return {
+            "type": "item",
+            "index": index,
+            "user_id": preferences.user_id,
+            "elapsed_ms": round((time.perf_counter() - item_started) * 1000, 1),
+            **shape_map_data(result, map_format),
+        }
+
+    tasks = [asyncio.ensure_future(run(index, preferences)) for index, preferences in enumerate(items)]
+    counts = Counter()
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            event = await next_done
+            counts[event["type"]] += 1
+            counts["cached"] += bool(event.get("cached"))
+            yield json.dumps(event) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    yield json.dumps({
+        "type": "done",
+        "items": len(items),
+        "succeeded": counts["item"],
+        "failed": counts["error"],
+        "cached": counts["cached"],
+        "geocoding": geocoder.stats(),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }) + "\n"
+
+@app.post("/generate_itinerary/multi_day")
+async def generate_multi_day_itinerary(request: MultiDayItineraryRequest, map_format: str = "full"):
+    """Generate one itinerary per day concurrently, without repeating places across days."""
+    check_map_format(map_format)
+    if not request.days:
+        raise HTTPException(status_code=400, detail="At least one day is required.")
+    if len(request.days) > MULTI_DAY_MAX_DAYS:
+        raise HTTPException(status_code=413, detail=f"A trip can have at most {MULTI_DAY_MAX_DAYS} days.")
+    return await build_multi_day_itinerary(request, map_format)
+
+def place_key(name):
+    """Identifies a place across days, ignoring case and a trailing ", City"."""
+    return normalize_key(name.split(",")[0])
+
+async def build_multi_day_itinerary(request, map_format="full"):
+    """Generates every day at once and merges them, so the trip takes about as long as its slowest day.
+
+    The city's popular places are shared out between the days up front, and each day's
+    prompt excludes the others' share. While the days stream, stops are claimed in a
+    shared exclusion map: a place another day already claimed is dropped. Geocoding is
+    shared, so a place is looked up once for the whole trip.
+    """
+    started = time.perf_counter()
+    preferences = request.preferences
+    total = len(request.days)
+    recommendations = await get_recommendations_based_on_city(preferences.city)
+    if recommendations == DEFAULT_RECOMMENDATIONS:
+        recommendations = []  # generic categories, not places to share out
+    highlights = [recommendations[index::total] for index in range(total)]
+    excluded = list(request.exclude or [])
+    claimed = {place_key(name): None for name in excluded}
+    claimed_names = {}   # place key -> name as the claiming day's model wrote it
+    geocoder = BatchGeocoder()
+
+    async def plan_day(index, day):
+        day_started = time.perf_counter()
+        day_preferences = preferences.copy(update={
+            "start_time": day.start_time or preferences.start_time,
+            "end_time": day.end_time or preferences.end_time,
+        })
+        others = [name for other, names in enumerate(highlights) if other != index for name in names]
+        stops = []
+        duplicates = []
+        lookups = []
+
+        def claim(stop):
+            key = place_key(stop["name"])
+            owner = claimed.setdefault(key, index)
+            if owner != index:
+                duplicates.append(stop["name"])
+                return
+            claimed_names[key] = stop["name"]
+            stops.append(stop)
+            lookups.append(asyncio.ensure_future(geocode_stops([stop], preferences.city, geocoder.get)))
+
+        async def generate(exclude):
+            prompt = build_day_prompt(day_preferences, index + 1, total, day.date, highlights[index], exclude)
+            if ITINERARY_FORMAT == "json":
+                response, parsed = await generate_structured_itinerary(prompt)
+                for stop in parsed:
+                    claim(stop)
+                return response
+            response = ""
+            parser = StopParser()
+            try:
+                async for chunk in stream_text(prompt):
+                    response += chunk
+                    for stop in parser.feed(chunk):
+                        claim(stop)
+            except (httpx.HTTPError, json.JSONDecodeError) as e:
+                response = f"Request failed: {e}"
+            for stop in parser.close():
+                claim(stop)
+            return response
+
+        async with multi_day_llm_slots:
+            response = await generate(excluded + others)
+            if not stops and duplicates:
+                # Every stop repeated another day: try once more, naming what the other days have taken
+                taken = [name for key, name in claimed_names.items() if claimed[key] != index]
+                response = await generate(list(dict.fromkeys(excluded + others + duplicates + taken)))
+        generated = time.perf_counter()
+
+        geocoded = [found for lookup in await asyncio.gather(*lookups) for found in lookup]
+        map_data, geocoding = collect_map_data(stops, geocoded)
+        with metrics.timed("route"):
+            map_data, route = plan_route(map_data, day_preferences.start_time, day_preferences.end_time)
+        itinerary, stops, geocoding = follow_route(response, stops, geocoding, map_data, route)
+        finished = time.perf_counter()
+        result = {
+            "day": index + 1,
+            "date": day.date,
+            "start_time": day_preferences.start_time,
+            "end_time": day_preferences.end_time,
+            "itinerary": itinerary,
+            "stops": stops,
+            "map_data": map_data,
+            "route": route,
+            "geocoding": geocoding,
+            "duplicates_removed": duplicates,
+            "latency_ms": {
+                "generation": round((generated - day_started) * 1000, 1),
+                "geocoding": round((finished - generated) * 1000, 1),
+                "total": round((finished - day_started) * 1000, 1),
+            },
         }
+        if stops:
+            result["itinerary_id"] = save_itinerary(day_preferences, result)
+        elif duplicates:
+            result["error"] = "Every suggested stop repeated another day, including after a retry."
+        else:
+            result["error"] = "No stops could be generated for this day."
+        return shape_map_data(result, map_format)
+
+    days = await asyncio.gather(*(plan_day(index, day) for index, day in enumerate(request.days)))
+    day_totals = [day["latency_ms"]["total"] for day in days]
+    return {
+        "city": preferences.city,
+        "days": days,
+        "failed_days": [day["day"] for day in days if "error" in day],
+        "stops": sum(len(day["stops"]) for day in days),
+        "duplicates_removed": sum(len(day["duplicates_removed"]) for day in days),
+        "geocoding": geocoder.stats(),
+        "latency_ms": {
+            "total": round((time.perf_counter() - started) * 1000, 1),
+            "slowest_day": max(day_totals),
+            "sum_of_days": round(sum(day_totals), 1),
+        },
+    }
+
+@app.get("/itineraries/{itinerary_id}")
+async def get_saved_itinerary(itinerary_id: str, map_format: str = "full"):
+    """Return a generated or edited itinerary by id."""
+    check_map_format(map_format)
+    saved = saved_itineraries.get(itinerary_id)
+    if saved is MISSING:
+        raise HTTPException(status_code=404, detail="Unknown or expired itinerary id.")
+    return shape_map_data({**saved["result"], "itinerary_id": itinerary_id}, map_format)
+
+@app.post("/itineraries/edit_stop")
+async def edit_itinerary_stop(request: StopEditRequest, map_format: str = "full"):
+    """Replace one stop of an itinerary without regenerating the rest, and return what changed."""
+    check_map_format(map_format)
+    if request.itinerary_id:
+        saved = saved_itineraries.get(request.itinerary_id)
+        if saved is MISSING:
+            raise HTTPException(status_code=404, detail="Unknown or expired itinerary id; send the itinerary instead.")
+        preferences, result = UserPreference(**saved["preferences"]), saved["result"]
+    elif request.itinerary and request.preferences:
+        # Checked before generating, so a malformed itinerary fails here rather than after the LLM call
+        try:
+            itinerary = EditableItinerary(**without_none(request.itinerary))
+        except ValidationError as e:
+            error = e.errors()[0]
+            location = ".".join(str(part) for part in error["loc"])
+            raise HTTPException(status_code=400, detail=f"Invalid itinerary at {location}: {error['msg']}. Send its stops and full map_data.")
+        preferences, result = request.preferences, itinerary.dict(exclude_none=True)
+    else:
+        raise HTTPException(status_code=400, detail="Send an itinerary_id, or an itinerary with its preferences.")
+    if not 0 <= request.stop_index < len(result["stops"]):
+        raise HTTPException(status_code=400, detail=f"stop_index must be between 0 and {len(result['stops']) - 1}.")
+
+    edited, diff, latency = await replace_stop(preferences, result, request.stop_index, request.instruction)
+    itinerary_id = save_itinerary(preferences, edited)
+    return {
+        "itinerary_id": itinerary_id,
+        "based_on": request.itinerary_id,
+        "stop_index": request.stop_index,
+        "stop": edited["stops"][request.stop_index],
+        "diff": diff,
+        "latency_ms": latency,
+        "result": shape_map_data({**edited, "itinerary_id": itinerary_id}, map_format),
+    }
+
+async def replace_stop(preferences, result, index, instruction):
+    """Regenerates stop `index` alone, geocodes only the new place and re-times the legs around it.
+
+    Returns the edited itinerary, a diff against the original and the latency of each step.
+    """
+    started = time.perf_counter()
+    stops = result["stops"]
+    old_stop = stops[index]
+    taken = {place_key(stop["name"]) for position, stop in enumerate(stops) if position != index}
+    prompt = build_edit_prompt(preferences, stops, index, instruction)
+
+    new_stop = None
+    if ITINERARY_FORMAT == "json":
+        _, candidates = await generate_structured_itinerary(prompt, OLLAMA_EDIT_NUM_PREDICT)
+        new_stop = next((stop for stop in candidates if place_key(stop["name"]) not in taken), None)
+    else:
+        parser = StopParser()
+        try:
+            async with aclosing(stream_text(prompt, num_predict=OLLAMA_EDIT_NUM_PREDICT)) as chunks:
+                async for chunk in chunks:
+                    new_stop = next((stop for stop in parser.feed(chunk) if place_key(stop["name"]) not in taken), None)
+                    if new_stop:
+                        break  # stop generating as soon as one usable stop is complete
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            raise HTTPException(status_code=502, detail=f"Request failed: {e}")
+        if new_stop is None:
+            new_stop = next((stop for stop in parser.close() if place_key(stop["name"]) not in taken), None)
+    if new_stop is None:
+        raise HTTPException(status_code=502, detail="The model did not suggest a new place for this stop.")
+    # Keep the slot's timing and travel details where the model left them out
+    for field in ("start_time", "end_time", "travel_method", "travel_time"):
+        if new_stop.get(field) is None:
+            new_stop[field] = old_stop.get(field)
+    generated = time.perf_counter()
+
+    coordinates = await get_coordinates(new_stop["name"], preferences.city, new_stop.get("address"))
+    found = coordinates != (None, None)
+    geocoded = time.perf_counter()
+
+    old_map = result.get("map_data") or []
+    new_map = list(old_map)
+    position = next((p for p, entry in enumerate(old_map) if entry["place"] == old_stop["name"]), None)
+    if position is None:
+        # The old stop never made it onto the map: add the new one after the stops before it
+        earlier = {stop["name"] for stop in stops[:index]}
+        position = 1 + max((p for p, entry in enumerate(old_map) if entry["place"] in earlier), default=-1)
+        if found:
+            new_map.insert(position, map_entry(new_stop, coordinates))
+    elif found:
+        new_map[position] = map_entry(new_stop, coordinates)
+    else:
+        del new_map[position]
+    # Legs arriving at the edited position and at the stop after it are the only ones measured again
+    with metrics.timed("route"):
+        new_map, totals = reschedule(new_map, preferences.start_time, preferences.end_time, {position, position + 1})
+    route = {**(result.get("route") or {}), **totals} if new_map else None
+    if route and len(new_map) != len(old_map):
+        route["order"] = list(range(len(new_map)))
+
+    new_stops = stops[:index] + [new_stop] + stops[index + 1:]
+    geocoding = list(result.get("geocoding") or [])
+    report = {"place": new_stop["name"], "found": found, "elapsed_ms": round((geocoded - generated) * 1000, 1)}
+    if index < len(geocoding):
+        geocoding[index] = report
+    edited = {
+        "itinerary": render_stops(new_stops, total_cost(result.get("itinerary"))),
+        "stops": new_stops,
+        "map_data": new_map,
+        "route": route,
+        "geocoding": geocoding,
+    }
+    diff = {
+        "stop": changed_fields(old_stop, new_stop),
+        "map_data": map_data_diff(old_map, new_map, position),
+        "route": changed_fields(result.get("route") or {}, route or {}),
+    }
+    latency = {
+        "generation": round((generated - started) * 1000, 1),
+        "geocoding": round((geocoded - generated) * 1000, 1),
+        "total": round((time.perf_counter() - started) * 1000, 1),
+    }
+    return edited, diff, latency
+
+def without_none(value):
+    """Drops None values at any depth, so that echoed-back nulls validate against `str = None` fields."""
+    if isinstance(value, dict):
+        return {key: without_none(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [without_none(item) for item in value]
+    return value
+
+def changed_fields(before, after):
+    """Returns {field: [before, after]} for every field whose value differs."""
+    fields = list(before) + [field for field in after if field not in before]
+    return {field: [before.get(field), after.get(field)] for field in fields if before.get(field) != after.get(field)}
+
+def map_data_diff(old_map, new_map, position):
+    """Lists the map_data entries an edit at `position` changed, pairing entries before and after it."""
+    old_aligned, new_aligned = list(old_map), list(new_map)
+    if len(new_aligned) < len(old_aligned):
+        new_aligned.insert(position, None)   # the edited stop dropped off the map
+    elif len(new_aligned) > len(old_aligned):
+        old_aligned.insert(position, None)   # the edited stop is on the map for the first time
+    changes = []
+    for index, (before, after) in enumerate(zip(old_aligned, new_aligned)):
+        fields = changed_fields(before or {}, after or {})
+        if fields:
+            place = (after or before)["place"]
+            changes.append({"index": index, "place": place, "change": "replaced" if index == position else "retimed",
+                            "fields": fields})
+    return changes
+
+async def run_itinerary_job(job):
+    """Runs an itinerary job through the streaming pipeline, publishing stops and map entries as they arrive."""
+    preferences, bypass_cache, map_format = job.payload
+    text = ""
+    stops = []
+    map_data = []
+    async for event in itinerary_events(preferences, bypass_cache, map_format):
+        if event["type"] == "text":
+            text += event["text"]
+            job.partial["text"] = text
+        elif event["type"] == "stop":
+            stops.append(event["stop"])
+            job.update(stops=stops)
+        elif event["type"] == "map" and event["entry"]:
+            map_data.append(event["entry"])
+            job.update(map_data=map_data)
+        elif event["type"] == "error":
+            raise RuntimeError(event["detail"])
+        elif event["type"] == "done":
+            return {key: value for key, value in event.items() if key != "type"}
+
+itinerary_jobs = JobQueue(run_itinerary_job, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, retention=JOB_RETENTION)
+
+@app.post("/jobs/itinerary", status_code=202)
+async def submit_itinerary_job(preferences: UserPreference, priority: str = "interactive",
+                               bypass_cache: bool = False, map_format: str = "full"):
+    """Queue an itinerary for generation and return its job id right away."""
+    check_map_format(map_format)
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=422, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    try:
+        job = itinerary_jobs.submit((preferences, bypass_cache, map_format), priority)
+    except JobQueueFull as e:
+        raise HTTPException(
+            status_code=503, detail=f"Itinerary queue is full: {e}", headers={"Retry-After": str(e.retry_after)}
+        )
+    return {**job.view(itinerary_jobs.position(job)), "poll": f"/jobs/{job.id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0, after: int = -1):
+    """Return a job's status and partial or final results.
+
+    With `wait`, long-polls for up to that many seconds until the job changes
+    past version `after` (pass the last version seen) or finishes.
+    """
+    job = find_job(job_id)
+    await job.wait(after, min(wait, JOB_MAX_WAIT))
+    return job.view(itinerary_jobs.position(job))
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job."""
+    job = find_job(job_id)
+    if not itinerary_jobs.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}.")
+    return {"job_id": job.id, "status": "cancelling" if job.status == "running" else job.status}
+
+def find_job(job_id):
+    job = itinerary_jobs.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+    return job
+
+@app.get("/job_stats")
+async def job_stats():
+    """Report queue depth, wait times and worker utilisation of the itinerary job queue."""
+    return itinerary_jobs.stats()
+
+@app.post("/generate_itinerary/stream")
+async def generate_itinerary_stream(preferences: UserPreference, bypass_cache: bool = False, map_format: str = "full"):
+    """Stream the itinerary as NDJSON events, geocoding each stop while the model keeps generating."""
+    check_map_format(map_format)
+    return StreamingResponse(
+        ndjson(itinerary_events(preferences, bypass_cache, map_format)),
+        media_type="application/x-ndjson"
+    )
+
+async def ndjson(events):
+    """Encodes a stream of event dicts as newline-delimited JSON."""
+    async for event in events:
+        yield json.dumps(event) + "\n"
+
+async def itinerary_events(preferences, bypass_cache=False, map_format="full"):
+    """Yields text, stop, map and done events (as dicts) for a streamed itinerary."""
+    def event(**fields):
+        return fields
+
+    city = preferences.city
+    cache_key = itinerary_cache_key(preferences)
+    if not bypass_cache:
+        cached = itinerary_cache.get(cache_key)
+        if cached is not MISSING:
+            yield event(type="done", **shape_map_data({**cached, "cached": True}, map_format))
+            return
+
+    async def geocode(index, stop):
+        started = time.perf_counter()
+        coordinates = await get_coordinates(stop["name"], city, stop.get("address"))
+        return index, stop, coordinates, time.perf_counter() - started
+
+    def geocoded_event(task):
+        index, stop, coordinates, elapsed = task.result()
+        found = coordinates != (None, None)
+        geocoding[index] = {"place": stop["name"], "found": found, "elapsed_ms": round(elapsed * 1000, 1)}
+        if found:
+            map_data[index] = map_entry(stop, coordinates)
+        return event(type="map", index=index, entry=map_data.get(index), geocoding=geocoding[index])
+
+    text = ""
+    parser = StopParser()
+    stops = []
+    pending = []
+    map_data = {}
+    geocoding = {}
+    try:
+        async for chunk in stream_text(build_itinerary_prompt(preferences)):
+            text += chunk
+            yield event(type="text", text=chunk)
+            for stop in parser.feed(chunk):
+                yield event(type="stop", index=len(stops), stop=stop)
+                pending.append(asyncio.create_task(geocode(len(stops), stop)))
+                stops.append(stop)
+            for task in [task for task in pending if task.done()]:
+                pending.remove(task)
+                yield geocoded_event(task)
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        yield event(type="error", detail=f"Request failed: {e}")
+
+    for stop in parser.close():
+        yield event(type="stop", index=len(stops), stop=stop)
+        pending.append(asyncio.create_task(geocode(len(stops), stop)))
         stops.append(stop)
+    for task in pending:
+        await task
+        yield geocoded_event(task)
+
+    with metrics.timed("route"):
+        routed, route = plan_route([map_data[i] for i in sorted(map_data)], preferences.start_time, preferences.end_time)
+    itinerary, stops, report = follow_route(text, stops, [geocoding[i] for i in sorted(geocoding)], routed, route)
+    result = {
+        "itinerary": itinerary,
+        "stops": stops,
+        "map_data": routed,
+        "route": route,
+        "geocoding": report
+    }
+    if stops:
+        result["itinerary_id"] = save_itinerary(preferences, result)
+        itinerary_cache.set(cache_key, result)
+    yield event(type="done", **shape_map_data({**result, "cached": False}, map_format))
+
+def build_itinerary_prompt(preferences):
+    """Builds the user-specific part of the itinerary prompt."""
+    return (
+        f"Create a detailed itinerary for {preferences.city} that includes activities related "
+        f"to {preferences.interests}, starting from {preferences.starting_point or 'a central location'} "
+        f"at {preferences.start_time} and ending by {preferences.end_time}. "
+        f"Budget is approximately {preferences.budget}. Format the response as per the provided schema."
+    )
+
+def build_day_prompt(preferences, number, total, date=None, highlights=(), exclude=()):
+    """Builds the prompt for one day of a multi-day trip."""
+    prompt = build_itinerary_prompt(preferences)
+    prompt += f" This is day {number} of a {total}-day trip" + (f", on {date}." if date else ".")
+    if highlights:
+        prompt += " Plan the day around " + ", ".join(f'"{name}"' for name in highlights) + "."
+    if exclude:
+        prompt += (" Do not include these places, which are covered on other days: "
+                   + ", ".join(f'"{name}"' for name in exclude) + ".")
+    return prompt
+
+def build_edit_prompt(preferences, stops, index, instruction):
+    """Builds a short prompt asking for a single replacement for one stop."""
+    stop = stops[index]
+    previous = stops[index - 1]["name"] if index else preferences.starting_point or "the start of the day"
+    following = stops[index + 1]["name"] if index + 1 < len(stops) else "the end of the day"
+    slot = f"{stop.get('start_time')} - {stop.get('end_time')}" if stop.get("start_time") else "its time slot"
+    others = ", ".join(f'"{other["name"]}"' for position, other in enumerate(stops) if position != index)
+    return (
+        f"An itinerary for {preferences.city} (interests: {preferences.interests}, budget about "
+        f"{preferences.budget}) visits \"{stop['name']}\" from {slot}, after {previous} and before {following}. "
+        f"Suggest one replacement stop for it. Requested change: {instruction}. "
+        f"It must fit the same time slot and must not be any of these stops: {others}. "
+    ) + (
+        # The format instructions may precede this prompt (cached prefix) or follow it, so don't say where
+        "Reply with a stops list holding exactly one stop." if ITINERARY_FORMAT == "json"
+        else "Reply with exactly one stop, numbered 1, in the itinerary format given in the instructions."
+    )
+
+async def geocode_stops(stops, city, lookup=None):
+    """Geocodes all stops concurrently, returning (coordinates, seconds) in stop order."""
+    lookup = lookup or get_coordinates
+
+    async def geocode(stop):
+        started = time.perf_counter()
+        coordinates = await lookup(stop["name"], city, stop.get("address"))
+        return coordinates, time.perf_counter() - started
+
+    return await asyncio.gather(*(geocode(stop) for stop in stops))
+
+def map_entry(stop, coordinates):
+    """Builds the map_data entry for a geocoded stop."""
+    return {
+        "place": stop["name"],
+        "coordinates": coordinates,
+        "address": stop["address"],
+        "start_time": stop["start_time"],
+        "end_time": stop["end_time"],
+        "activity": stop["activity"],
+        "travel_method": stop["travel_method"],
+        "cost": stop["cost"]
+    }
+
+def extract_stops_from_response(response_text):
+    """Extracts stops with detailed location info from the LLM-generated response text."""
+    return parse_stops(response_text)
+
+async def generate_structured_itinerary(prompt, num_predict=None):
+    """Generates the itinerary as schema-constrained JSON; returns (itinerary text, stops)."""
+    response = await generate_text(prompt, ITINERARY_JSON_SCHEMA, num_predict)
+    try:
+        output = ItineraryOutput(**json.loads(response))
+    except (ValueError, TypeError) as e:
+        # Invalid JSON (e.g. cut off by num_predict) or a schema mismatch
+        print(f"Structured itinerary could not be validated: {e}")
+        return response, []
+    return render_itinerary(output), [stop.dict() for stop in output.stops]
+
+def render_itinerary(output):
+    """Renders a structured itinerary in the same numbered layout as the text format."""
+    lines = []
+    for number, stop in enumerate(output.stops, start=1):
+        lines.append(f"{number}. Stop Name: {stop.name}")
+        for label, value in (
+            ("Address", stop.address),
+            ("Time", f"{stop.start_time} - {stop.end_time}" if stop.start_time and stop.end_time else None),
+            ("Activity", stop.activity),
+            ("Travel Method", stop.travel_method),
+            ("Travel Time", stop.travel_time),
+            ("Cost", stop.cost),
+            ("Additional Notes", stop.notes),
+        ):
+            if value:
+                lines.append(f"   - {label}: {value}")
+        lines.append("")
+    if output.total_cost:
+        lines.append(f"Total Estimated Cost: {output.total_cost}")
+    return "\n".join(lines).strip()
+
+def render_stops(stops, total_cost=None):
+    """Renders parsed stops as itinerary text, for when the LLM's own text no longer matches them."""
+    output = ItineraryOutput(stops=[{field: value for field, value in stop.items() if value is not None} for stop in stops])
+    output.total_cost = total_cost
+    return format_itinerary(render_itinerary(output))
 
-    return stops
+def total_cost(text):
+    """Returns the "Total Estimated Cost" from itinerary text, or None."""
+    match = TOTAL_COST_PATTERN.search(text or "")
+    return match.group(1).strip() if match else None
 
 def format_itinerary(raw_text):
     formatted_text = f"{raw_text}\n\nWeather Recommendation: Ideal for outdoor activities."
@@ -0,0 +1,117 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Stage timings of the request being handled, collected for its Server-Timing header
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+registry = []
+
+def format_labels(names, values, extra=""):
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """Monotonic counter with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {bucket_count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+def render():
+    """Returns every registered metric in Prometheus text exposition format."""
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+stage_seconds = Histogram("stage_seconds", "Time spent in each stage of request handling.", ["stage"])
+
+def record_timing(stage, seconds):
+    """Adds a stage's duration to its histogram and to the current request's Server-Timing."""
+    stage_seconds.observe(seconds, stage=stage)
+    add_server_timing(stage, seconds)
+
+def add_server_timing(name, seconds):
+    """Adds an entry to the current request's Server-Timing header, if there is a request."""
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+@contextmanager
+def timed(stage):
+    """Times the enclosed block as `stage`; works around awaits as well as plain code."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(stage, time.perf_counter() - started)
+
+def server_timing_header(timings):
+    """Formats (stage, seconds) pairs as a Server-Timing header, summing repeated stages."""
+    totals = {}
+    for stage, seconds in timings:
+        total, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + seconds, count + 1)
+    entries = []
+    for stage, (total, count) in totals.items():
+        entry = f"{stage};dur={total * 1000:.1f}"
+        if count > 1:
+            entry += f';desc="{count} calls"'
+        entries.append(entry)
+    return ", ".join(entries)
@@ -0,0 +1,117 @@
+import asyncio
+import random
+import time
+
+import httpx
+
+class CircuitOpen(httpx.TransportError):
+    """Raised instead of calling an upstream whose circuit breaker is open.
+
+    It is a TransportError so existing handlers for unreachable upstreams
+    also serve their fallbacks for it.
+    """
+
+class CircuitBreaker:
+    """Fails calls fast after `failure_threshold` consecutive failures.
+
+    Once open, calls are refused for `reset_timeout` seconds; then a single
+    trial call is let through (half-open). Its success closes the breaker,
+    its failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, on_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_running = False
+
+    def check(self):
+        """Raises CircuitOpen unless a call may go ahead now."""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} circuit is open")
+            self._set_state("half_open")
+        if self.state == "half_open":
+            if self._trial_running:
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} circuit is half-open and already trying a call")
+            self._trial_running = True
+
+    def success(self):
+        self.failures = 0
+        self._trial_running = False
+        if self.state != "closed":
+            self._set_state("closed")
+
+    def failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._set_state("open")
+
+    def abandon(self):
+        """Ends a call that neither succeeded nor failed (e.g. it was cancelled)."""
+        self._trial_running = False
+
+    def _set_state(self, state):
+        print(f"Circuit breaker for {self.name}: {self.state} -> {state}")
+        self.state = state
+        if self.on_change:
+            self.on_change(self.name, state)
+
+    def stats(self):
+        retry_in = None
+        if self.state == "open":
+            retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_in_s": retry_in,
+        }
+
+def is_retryable(error):
+    """Connection problems, timeouts, 429 and 5xx responses are worth another try; other 4xx are not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+async def call_with_retries(call, breaker, retries=2, backoff=0.25, max_backoff=2.0, on_retry=None):
+    """Awaits `call()` through `breaker`, retrying retryable httpx errors with full-jitter backoff.
+
+    Each failed attempt counts against the breaker, so a run of failures opens
+    it and later calls fail fast with CircuitOpen instead of waiting on timeouts.
+    """
+    for attempt in range(retries + 1):
+        breaker.check()
+        try:
+            result = await call()
+        except httpx.HTTPError as e:
+            if not is_retryable(e):
+                breaker.success()  # the upstream answered; the request itself was wrong
+                raise
+            breaker.failure()
+            if attempt == retries or breaker.state == "open":
+                raise
+            if on_retry:
+                on_retry(e)
+            await asyncio.sleep(random.uniform(0, min(max_backoff, backoff * 2 ** attempt)))
+        except BaseException:
+            # Cancelled or failed for reasons unrelated to the upstream: free a half-open trial slot
+            breaker.abandon()
+            raise
+        else:
+            breaker.success()
+            return result
@@ -0,0 +1,216 @@
+from datetime import datetime
+import numpy as np
+
+EARTH_DIAMETER_KM = 12742.0
+
+# Straight-line distance is stretched by this factor to approximate street distance
+DETOUR_FACTOR = 1.3
+
+# Average door-to-door speeds (km/h), matched against the stop's travel method
+TRAVEL_SPEEDS_KMH = {
+    "walk": 4.5,
+    "foot": 4.5,
+    "bike": 14.0,
+    "cycle": 14.0,
+    "bicycle": 14.0,
+    "rickshaw": 15.0,
+    "bus": 16.0,
+    "tram": 16.0,
+    "ferry": 20.0,
+    "boat": 20.0,
+    "subway": 25.0,
+    "metro": 25.0,
+    "underground": 25.0,
+    "train": 35.0,
+    "taxi": 22.0,
+    "cab": 22.0,
+    "uber": 22.0,
+    "car": 22.0,
+    "drive": 22.0,
+}
+DEFAULT_SPEED_KMH = 20.0
+DEFAULT_VISIT_MINUTES = 60
+
+def parse_clock(value):
+    """Parses a time like '9:30 AM' or '14:00' into minutes after midnight, or None."""
+    if not value:
+        return None
+    for fmt in ("%I:%M %p", "%I:%M%p", "%I %p", "%I%p", "%H:%M"):
+        try:
+            parsed = datetime.strptime(value.strip().upper().replace(".", ""), fmt)
+        except ValueError:
+            continue
+        return parsed.hour * 60 + parsed.minute
+    return None
+
+def format_clock(minutes):
+    minutes = int(round(minutes)) % (24 * 60)
+    hour, minute = divmod(minutes, 60)
+    return f"{hour % 12 or 12}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+
+def travel_speed(travel_method):
+    """Returns the speed in km/h for a free-text travel method such as 'Taxi' or 'Walk'."""
+    method = (travel_method or "").lower()
+    for keyword, speed in TRAVEL_SPEEDS_KMH.items():
+        if keyword in method:
+            return speed
+    return DEFAULT_SPEED_KMH
+
+def distance_matrix(coordinates):
+    """Great-circle distances in km between every pair of (lat, lon) points."""
+    points = np.radians(np.asarray(coordinates, dtype=float))
+    lat = points[:, 0][:, None]
+    lon = points[:, 1][:, None]
+    a = (np.sin((lat.T - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(lat.T) * np.sin((lon.T - lon) / 2) ** 2)
+    return EARTH_DIAMETER_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def travel_time_matrix(distances, speeds_kmh):
+    """Minutes to travel from stop i to stop j, using the arrival stop's travel speed."""
+    return distances * DETOUR_FACTOR / np.asarray(speeds_kmh, dtype=float)[None, :] * 60.0
+
+def path_cost(times, order):
+    order = np.asarray(order)
+    return float(times[order[:-1], order[1:]].sum())
+
+def nearest_neighbour(times):
+    """Greedy route from stop 0, always moving to the closest unvisited stop."""
+    n = len(times)
+    order = [0]
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[0] = False
+    for _ in range(n - 1):
+        row = np.where(unvisited, times[order[-1]], np.inf)
+        nxt = int(np.argmin(row))
+        order.append(nxt)
+        unvisited[nxt] = False
+    return order
+
+def two_opt(times, order):
+    """Improves an open route with a fixed first stop by reversing segments while it helps."""
+    best = list(order)
+    best_cost = path_cost(times, best)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(best) - 1):
+            for j in range(i + 1, len(best)):
+                candidate = best[:i] + best[i:j + 1][::-1] + best[j + 1:]
+                cost = path_cost(times, candidate)
+                if cost < best_cost - 1e-9:
+                    best, best_cost, improved = candidate, cost, True
+    return best
+
+def visit_minutes(entry):
+    """Length of a stop's visit from its start and end times, or the default when they are unusable."""
+    start, end = parse_clock(entry.get("start_time")), parse_clock(entry.get("end_time"))
+    return end - start if start is not None and end is not None and end > start else DEFAULT_VISIT_MINUTES
+
+def leg(origin, destination):
+    """Street distance (km) and travel minutes between two map_data entries, at the destination's speed."""
+    distance = float(distance_matrix([origin["coordinates"], destination["coordinates"]])[0, 1]) * DETOUR_FACTOR
+    return distance, distance / travel_speed(destination.get("travel_method")) * 60.0
+
+def plan_route(map_data, start_time=None, end_time=None, min_saving_minutes=1.0):
+    """Checks the stop order against real coordinates and reorders it when that saves travel.
+
+    Returns the (possibly reordered) map_data with computed per-leg distance
+    and travel time, and a route summary with the schedule that results from
+    keeping each stop's visit length and starting at the user's start time.
+    A reordering is only kept if it saves at least `min_saving_minutes` and
+    does not make the day overrun the user's end time more than the original.
+    """
+    if not map_data:
+        return map_data, None
+    durations = [visit_minutes(entry) for entry in map_data]
+    distances = distance_matrix([entry["coordinates"] for entry in map_data])
+    times = travel_time_matrix(distances, [travel_speed(entry.get("travel_method")) for entry in map_data])
+
+    original = list(range(len(map_data)))
+    optimized = two_opt(times, nearest_neighbour(times)) if len(map_data) > 2 else original
+
+    day_start = parse_clock(start_time)
+    if day_start is None:
+        day_start = parse_clock(map_data[0].get("start_time")) or 9 * 60
+    day_end = parse_clock(end_time)
+
+    def finish(order):
+        return day_start + sum(durations) + path_cost(times, order)
+
+    saving = path_cost(times, original) - path_cost(times, optimized)
+    overruns = day_end is not None and finish(optimized) > max(day_end, finish(original))
+    order = optimized if saving >= min_saving_minutes and not overruns else original
+
+    routed = []
+    clock = day_start
+    total_km = 0.0
+    for position, index in enumerate(order):
+        leg_km = leg_minutes = 0.0
+        if position:
+            previous = order[position - 1]
+            leg_km = float(distances[previous, index]) * DETOUR_FACTOR
+            leg_minutes = float(times[previous, index])
+        total_km += leg_km
+        clock += leg_minutes
+        routed.append({
+            **map_data[index],
+            "distance_km": round(leg_km, 2),
+            "computed_travel_minutes": round(leg_minutes),
+            "scheduled_start": format_clock(clock),
+            "scheduled_end": format_clock(clock + durations[index]),
+        })
+        clock += durations[index]
+
+    route = {
+        "order": order,
+        "reordered": order != original,
+        "total_distance_km": round(total_km, 2),
+        "total_travel_minutes": round(path_cost(times, order)),
+        "saved_travel_minutes": round(saving) if order != original else 0,
+        "ends_at": format_clock(clock),
+        "fits_window": day_end is None or clock <= day_end,
+    }
+    return routed, route
+
+def reschedule(routed, start_time=None, end_time=None, changed=()):
+    """Recomputes the schedule of a routed day in its current order, without reordering it.
+
+    Only the legs arriving at the positions in `changed` are measured again;
+    the others keep the distance_km and computed_travel_minutes plan_route
+    gave them. Returns the updated entries and the route totals.
+    """
+    day_start = parse_clock(start_time)
+    if day_start is None:
+        day_start = (parse_clock(routed[0].get("start_time")) if routed else None) or 9 * 60
+    day_end = parse_clock(end_time)
+
+    updated = []
+    clock = day_start
+    total_km = total_minutes = 0.0
+    for position, entry in enumerate(routed):
+        leg_km = leg_minutes = 0.0
+        if position:
+            if position in changed or "computed_travel_minutes" not in entry:
+                leg_km, leg_minutes = leg(routed[position - 1], entry)
+            else:
+                leg_km, leg_minutes = entry["distance_km"], entry["computed_travel_minutes"]
+        total_km += leg_km
+        total_minutes += leg_minutes
+        clock += leg_minutes
+        duration = visit_minutes(entry)
+        updated.append({
+            **entry,
+            "distance_km": round(leg_km, 2),
+            "computed_travel_minutes": round(leg_minutes),
+            "scheduled_start": format_clock(clock),
+            "scheduled_end": format_clock(clock + duration),
+        })
+        clock += duration
+
+    totals = {
+        "total_distance_km": round(total_km, 2),
+        "total_travel_minutes": round(total_minutes),
+        "ends_at": format_clock(clock),
+        "fits_window": day_end is None or clock <= day_end,
+    }
+    return updated, totals
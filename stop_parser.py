@@ -0,0 +1,112 @@
+import re
+
+# Field labels the LLM is asked to use, mapped to stop keys. Labels are matched
+# after lowercasing and stripping bullets, numbering and markdown emphasis.
+FIELD_LABELS = {
+    "stop name": "name",
+    "stop": "name",
+    "address": "address",
+    "time": "time",
+    "activity": "activity",
+    "travel method": "travel_method",
+    "travel time": "travel_time",
+    "cost": "cost",
+    "additional notes": "notes",
+    "notes": "notes",
+}
+
+# Lines with these labels close the current stop without starting a new one
+END_LABELS = {"total estimated cost", "total cost"}
+
+STOP_FIELDS = ("name", "address", "start_time", "end_time", "activity",
+               "travel_method", "travel_time", "cost", "notes")
+
+# Single-line, anchor-free pattern with no nested quantifiers: linear per line
+TIME_PATTERN = re.compile(r"\d{1,2}(?::\d{2})?\s*[AaPp]\.?[Mm]\.?|\d{1,2}:\d{2}")
+
+LEADING_MARKUP = " \t-*•#>"
+
+def parse_label(line):
+    """Splits 'label: value' into a normalized label and value, or returns (None, line)."""
+    label, sep, value = line.partition(":")
+    if not sep or len(label) > 40:
+        return None, line
+    label = label.strip(LEADING_MARKUP)
+    number, dot, rest = label.partition(".")
+    if dot and number.strip().isdigit():
+        label = rest
+    label = " ".join(label.replace("*", " ").replace("_", " ").lower().split())
+    return label, value.strip().strip("*").strip()
+
+class StopParser:
+    """Single-pass, incremental parser for itinerary stops in LLM output.
+
+    Text can be fed in arbitrary chunks; each complete line is examined once,
+    so total work is linear in the input size. A stop is emitted as soon as
+    the next stop (or an end marker) begins. Missing or reordered fields are
+    tolerated; only the stop name is required.
+    """
+
+    def __init__(self):
+        self._partial = []
+        self._current = None
+        self._last_field = None
+
+    def feed(self, chunk):
+        """Consumes a chunk of text and returns the stops it completed."""
+        self._partial.append(chunk)
+        if "\n" not in chunk:
+            return []
+        *lines, tail = "".join(self._partial).split("\n")
+        self._partial = [tail]
+        completed = []
+        for line in lines:
+            stop = self._consume_line(line)
+            if stop:
+                completed.append(stop)
+        return completed
+
+    def close(self):
+        """Flushes any buffered text and returns the remaining stops."""
+        completed = self.feed("\n")
+        stop = self._finish()
+        if stop:
+            completed.append(stop)
+        return completed
+
+    def _consume_line(self, line):
+        if not line.strip():
+            return None
+        label, value = parse_label(line)
+        field = FIELD_LABELS.get(label)
+        if field == "name":
+            finished = self._finish()
+            self._current = {"name": value}
+            self._last_field = "name"
+            return finished
+        if label in END_LABELS:
+            return self._finish()
+        if self._current is None:
+            return None
+        if field:
+            if field not in self._current:
+                self._current[field] = value
+            self._last_field = field
+        elif self._last_field in ("activity", "notes", "address"):
+            # Wrapped continuation of a free-text field
+            self._current[self._last_field] += " " + line.strip(LEADING_MARKUP)
+        return None
+
+    def _finish(self):
+        stop, self._current, self._last_field = self._current, None, None
+        if not stop or not stop.get("name"):
+            return None
+        times = TIME_PATTERN.findall(stop.pop("time", "") or "")
+        stop["start_time"] = times[0].strip() if times else None
+        stop["end_time"] = times[1].strip() if len(times) > 1 else None
+        return {field: stop.get(field) for field in STOP_FIELDS}
+
+def parse_stops(text):
+    """Parses all stops from a complete LLM response."""
+    parser = StopParser()
+    return parser.feed(text) + parser.close()
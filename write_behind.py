@@ -0,0 +1,88 @@
+import asyncio
+from fastapi.concurrency import run_in_threadpool
+
+class QueueFull(Exception):
+    """Raised when a write cannot be queued before the enqueue timeout."""
+
+class WriteBehindQueue:
+    """Buffers writes off the request path and flushes them in batches.
+
+    `flush` is a blocking callable taking a list of items; it runs in the
+    threadpool. A batch is flushed once it reaches `max_batch` items or
+    `flush_interval` seconds after its first item arrived. When `key` is
+    given, only the latest item per key is kept within a batch. Callers are
+    held back (backpressure) while `max_pending` items are waiting.
+    """
+
+    def __init__(self, flush, max_batch=100, flush_interval=1.0, max_pending=10000,
+                 max_retries=3, key=None):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.key = key
+        self.queue = asyncio.Queue(max_pending)
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self._runner = None
+
+    def start(self):
+        self._runner = asyncio.ensure_future(self._run())
+
+    async def put(self, item, timeout=None):
+        """Queues an item, waiting up to `timeout` seconds for space."""
+        try:
+            await asyncio.wait_for(self.queue.put(item), timeout)
+        except asyncio.TimeoutError:
+            raise QueueFull(f"{self.queue.qsize()} writes already pending")
+
+    async def close(self, timeout=10.0):
+        """Flushes everything still queued, then stops the flusher."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Write-behind queue closed with {self.queue.qsize()} writes unflushed.")
+        if self._runner:
+            self._runner.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush_batch(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _flush_batch(self, batch):
+        items = list({self.key(item): item for item in batch}.values()) if self.key else batch
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                await run_in_threadpool(self.flush, items)
+                self.written += len(items)
+                self.batches += 1
+                return
+            except Exception as e:
+                self.failures += 1
+                print(f"Write-behind flush of {len(items)} items failed (attempt {attempt}): {e}")
+                await asyncio.sleep(self.flush_interval * attempt)
+        self.dropped += len(items)
+
+    def stats(self):
+        return {
+            "pending": self.queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }